@@ -0,0 +1,112 @@
+"""Stage timings of the build pipeline on synthetic forum data.
+
+Generates scraped-topic JSON, then times conv_markdown.convert, the
+chunker and generate_embeddings (against the fake Ollama /api/embed) in a
+scratch directory, reporting wall time, throughput and peak memory per stage.
+
+    python benchmarks/bench_build.py --topics 500 --posts-per-topic 40 --output build.json
+"""
+import os
+import json
+import time
+import random
+import argparse
+import tempfile
+from common import peak_rss_mb, emit
+from fake_openai import make_app, serve_in_thread
+
+WORDS = ("docker", "image", "build", "port", "uvicorn", "fastapi", "numpy", "pandas", "deadline", "marks",
+         "submission", "error", "token", "proxy", "github", "pages", "vercel", "json", "csv", "score")
+
+def synthetic_words(seed, count):
+    """Return `count` pseudo-random words, distinct per seed so deduplication keeps every post."""
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) for _ in range(count)) + "."
+
+def write_topics(input_dir, topics, posts_per_topic):
+    os.makedirs(input_dir, exist_ok=True)
+    for topic_id in range(1, topics + 1):
+        slug = f"synthetic-topic-{topic_id}"
+        posts = [
+            {
+                "id": topic_id * 1000 + n,
+                "topic_id": topic_id,
+                "topic_slug": slug,
+                "post_number": n,
+                "post_url": f"/t/{slug}/{topic_id}/{n}",
+                "name": f"Student {n % 97}",
+                "username": f"student{n % 97}",
+                "created_at": f"2025-02-{n % 28 + 1:02d}T10:00:00.000Z",
+                "cooked": f"<p>Post {n} of topic {topic_id}: how do I fix the docker build for GA{n % 7 + 1}? " + synthetic_words(topic_id * 1000 + n, 40) + "</p>",
+                "reactions": [],
+            }
+            for n in range(1, posts_per_topic + 1)
+        ]
+        with open(os.path.join(input_dir, f"{slug}.json"), "w", encoding="utf-8") as f:
+            json.dump(posts, f)
+
+def timed(stage, function, items=None):
+    start = time.perf_counter()
+    value = function()
+    seconds = time.perf_counter() - start
+    result = {"stage": stage, "seconds": seconds, "peak_rss_mb": peak_rss_mb()}
+    if items is not None:
+        result["items"] = items(value)
+        result["items_per_second"] = result["items"] / seconds if seconds else None
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time conv_markdown, chunking and generate_embeddings on synthetic data.")
+    parser.add_argument("--topics", type=int, default=200)
+    parser.add_argument("--posts-per-topic", type=int, default=40)
+    parser.add_argument("--workers", type=int, help="conv_markdown processes (default: CPU count)")
+    parser.add_argument("--embed-latency", type=float, default=0.02, help="Seconds per fake /api/embed call")
+    parser.add_argument("--output", help="Write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output) if args.output else None
+    _, fake_url = serve_in_thread(make_app(embed_latency=args.embed_latency, chat_latency=0))
+    os.environ["OLLAMA_API"] = f"{fake_url}/api"
+    results = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="bench-build-") as workdir:
+        # The pipeline scripts use paths relative to the working directory
+        os.chdir(workdir)
+        try:
+            from codefiles import conv_markdown
+            import chunking
+
+            results.append(timed("generate_topics", lambda: write_topics("sc", args.topics, args.posts_per_topic)))
+            results.append(timed(
+                "conv_markdown",
+                lambda: conv_markdown.convert("sc", "forum_posts.md", workers=args.workers),
+                items=lambda value: value[0]["posts_kept"],
+            ))
+            results.append(timed(
+                "chunking",
+                lambda: chunking.chunk_markdown("forum_posts.md", "chunks"),
+                items=lambda value: value[0],
+            ))
+            try:
+                import vercel_npzfile
+            except ImportError as e:
+                results.append({"stage": "generate_embeddings", "skipped": str(e)})
+            else:
+                results.append(timed(
+                    "generate_embeddings",
+                    lambda: vercel_npzfile.generate_embeddings(incremental=False),
+                    items=lambda value: len(value[0]),
+                ))
+                results.append(timed(
+                    "generate_embeddings_incremental_noop",
+                    lambda: vercel_npzfile.generate_embeddings(incremental=True),
+                    items=lambda value: len(value[0]),
+                ))
+        finally:
+            os.chdir(cwd)
+    for result in results:
+        result.update(topics=args.topics, posts_per_topic=args.posts_per_topic)
+    emit("build", results, output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Load test of the full /query endpoint against a local fake OpenAI server.
+
+Publishes a synthetic store, starts the fake API and the FastAPI app with
+uvicorn on local ports, then sends unique questions at each concurrency level.
+It reports end-to-end latency percentiles, throughput, errors and the mean
+per-stage breakdown from the X-Timing header. The answer cache is disabled so
+every request reaches the fake LLM.
+
+    python benchmarks/bench_query.py --chunks 50000 --concurrency 1,8,32 --chat-latency 0.5
+"""
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+import httpx
+from common import percentiles, peak_rss_mb, synthetic_store, emit
+from fake_openai import make_app, serve_in_thread
+
+def parse_timing(header):
+    timings = {}
+    for part in (header or "").split(";"):
+        name, _, value = part.partition("=")
+        if value:
+            timings[name] = float(value)
+    return timings
+
+async def run_load(base_url, concurrency, requests, offset):
+    """Send `requests` unique questions with `concurrency` in flight; returns (latencies, errors, stage means, seconds)."""
+    latencies, errors, stage_totals = [], 0, {}
+    next_request = iter(range(offset, offset + requests))
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def worker():
+            nonlocal errors
+            for i in next_request:
+                start = time.perf_counter()
+                try:
+                    response = await client.post("/query", json={"question": f"How do I submit GA{i % 7 + 1} question {i}?"}, headers={"X-Timing": "1"})
+                    response.raise_for_status()
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+                for name, value in parse_timing(response.headers.get("X-Timing")).items():
+                    stage_totals[name] = stage_totals.get(name, 0.0) + value
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    stage_means = {name: total / max(len(latencies), 1) for name, total in stage_totals.items()}
+    return latencies, errors, stage_means, elapsed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test /query against a fake OpenAI-compatible server.")
+    parser.add_argument("--chunks", type=int, default=50000, help="Synthetic store size")
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per concurrency level")
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--chat-latency", type=float, default=0.5)
+    parser.add_argument("--output", help="Write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    fake = make_app(args.embed_latency, args.chat_latency)
+    _, fake_url = serve_in_thread(fake)
+    with tempfile.TemporaryDirectory(prefix="bench-store-") as path:
+        synthetic_store(path, args.chunks)
+        # main.py reads its configuration at import time
+        os.environ.update({
+            "OPEN_API_KEY": "offline-benchmark",
+            "OPENAI_BASE_URL": f"{fake_url}/v1",
+            "VECTOR_STORE_PATH": path,
+            "ANSWER_CACHE_SIZE": "0",
+            "LOG_LEVEL": "WARNING",
+        })
+        import main as service
+
+        _, app_url = serve_in_thread(service.app)
+        results = []
+        offset = 0
+        for concurrency in [int(level) for level in args.concurrency.split(",")]:
+            calls_before = dict(fake.state.calls)
+            latencies, errors, stage_means, elapsed = asyncio.run(run_load(app_url, concurrency, args.requests, offset))
+            offset += args.requests
+            results.append({
+                "chunks": args.chunks,
+                "concurrency": concurrency,
+                "requests": args.requests,
+                "errors": errors,
+                "throughput_rps": len(latencies) / elapsed if elapsed else None,
+                "latency": percentiles(latencies) if latencies else None,
+                "stage_mean_ms": stage_means,
+                "embed_latency": args.embed_latency,
+                "chat_latency": args.chat_latency,
+                "upstream_calls": {name: count - calls_before[name] for name, count in fake.state.calls.items()},
+                "peak_rss_mb": peak_rss_mb(),
+            })
+    emit("query", results, args.output)
+
+if __name__ == "__main__":
+    main()
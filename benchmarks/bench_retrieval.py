@@ -0,0 +1,107 @@
+"""Retrieval latency and memory on synthetic stores.
+
+For each store size, publishes a random store with packed chunk texts, loads
+it the way the server does and times main.retrieve_top_chunks (scoring plus
+chunk reads) for each scoring mode. Runs offline: queries are perturbed
+stored rows, so no embeddings API is called.
+
+    python benchmarks/bench_retrieval.py --sizes 4000,50000,500000,2000000 --output retrieval.json
+
+A 2M x 768 float32 store needs about 6 GB on disk and roughly three times
+that in memory while it is generated.
+"""
+import os
+import gc
+import time
+import asyncio
+import argparse
+import tempfile
+import numpy as np
+from common import percentiles, rss_mb, peak_rss_mb, synthetic_store, emit
+
+# main.py builds its OpenAI client at import time; retrieval never calls it
+os.environ.setdefault("OPEN_API_KEY", "offline-benchmark")
+
+def make_queries(store, count, noise=0.05, seed=1):
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(len(store.embeddings), size=min(count, len(store.embeddings)), replace=False))
+    queries = np.asarray(store.embeddings[rows], dtype=np.float32)
+    queries = queries + rng.normal(scale=noise, size=queries.shape).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+async def time_retrieval(main, store, queries, k, warmup=5):
+    for query in queries[:warmup]:
+        await main.retrieve_top_chunks("benchmark", store, k=k, norm_query=query)
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        await main.retrieve_top_chunks("benchmark", store, k=k, norm_query=query)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def bench_size(main, count, dimension, modes, queries_per_mode, k, dtype):
+    from vector_store import load_snapshot
+    from retrieval import ExactBackend
+
+    quantize = next((mode for mode in modes if mode != "exact"), None)
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench-store-") as path:
+        start = time.perf_counter()
+        synthetic_store(path, count, dimension, dtype=dtype, quantize=quantize)
+        build_seconds = time.perf_counter() - start
+        gc.collect()
+        for mode in modes:
+            if mode not in ("exact", quantize):
+                # Publish the same rows with this mode's quantized copy, so it is
+                # memory-mapped from disk like the server's instead of built at load
+                start = time.perf_counter()
+                synthetic_store(path, count, dimension, dtype=dtype, quantize=mode)
+                build_seconds = time.perf_counter() - start
+                quantize = mode
+                gc.collect()
+            rss_before = rss_mb()
+            start = time.perf_counter()
+            store = load_snapshot(path, quantize=None if mode == "exact" else mode)
+            main.on_store_load(store)
+            store.backend = ExactBackend(store, mode=mode)
+            load_seconds = time.perf_counter() - start
+            rss_loaded = rss_mb()
+            samples = asyncio.run(time_retrieval(main, store, make_queries(store, queries_per_mode), k))
+            results.append({
+                "chunks": count,
+                "dimension": dimension,
+                "dtype": dtype,
+                "mode": mode,
+                "k": k,
+                "build_seconds": build_seconds,
+                "load_seconds": load_seconds,
+                "latency": percentiles(samples),
+                "rss_before_load_mb": rss_before,
+                "rss_after_load_mb": rss_loaded,
+                "rss_after_queries_mb": rss_mb(),
+                "peak_rss_mb": peak_rss_mb(),
+            })
+            del store
+            gc.collect()
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark retrieve_top_chunks on synthetic stores.")
+    parser.add_argument("--sizes", default="4000,50000", help="Comma-separated chunk counts")
+    parser.add_argument("--dimension", type=int, default=768)
+    parser.add_argument("--modes", default="exact,int8", help="Comma-separated scoring modes: exact, int8, float16")
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float32", help="Stored matrix dtype")
+    parser.add_argument("--queries", type=int, default=200, help="Timed queries per size and mode")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--output", help="Write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    import main as service
+
+    results = []
+    for count in [int(size) for size in args.sizes.split(",")]:
+        results.extend(bench_size(service, count, args.dimension, args.modes.split(","), args.queries, args.k, args.dtype))
+    emit("retrieval", results, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import os
+import sys
+import json
+import time
+import platform
+import resource
+import numpy as np
+
+# Benchmarks import the service modules from the repository root
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from vector_store import write_store, normalize_rows, content_pack_writer
+
+# Rows generated at a time when building a synthetic store
+GENERATE_BLOCK_ROWS = 65536
+
+def percentiles(samples):
+    """Summarize latency samples in seconds as milliseconds."""
+    samples = np.asarray(samples, dtype=np.float64) * 1000
+    return {
+        "count": int(len(samples)),
+        "mean_ms": float(samples.mean()),
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p90_ms": float(np.percentile(samples, 90)),
+        "p99_ms": float(np.percentile(samples, 99)),
+        "max_ms": float(samples.max()),
+    }
+
+def rss_mb():
+    """Current resident set size of this process in MiB (Linux), or None."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        return None
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+def synthetic_text(i):
+    topic, post = divmod(i, 20)
+    return (
+        f"### Post {post + 1}\n**Post URL**: /t/synthetic-topic-{topic}/{topic}/{post + 1}\n"
+        f"- **ID**: {i}\n- **Author**: Student {i % 97} (student{i % 97})\n- **Created At**: 2025-02-01T00:00:00Z\n"
+        f"- **Content**:  \n  Synthetic post {i} about assignment ga{i % 7 + 1} question {i % 13} and docker, numpy or fastapi.\n"
+    )
+
+def random_unit_rows(count, dimension, seed=0):
+    """Return a float32 matrix of random unit-length rows, generated block by block."""
+    rng = np.random.default_rng(seed)
+    embeddings = np.empty((count, dimension), dtype=np.float32)
+    for start in range(0, count, GENERATE_BLOCK_ROWS):
+        rows = min(GENERATE_BLOCK_ROWS, count - start)
+        embeddings[start:start + rows] = normalize_rows(rng.standard_normal((rows, dimension), dtype=np.float32))
+    return embeddings
+
+def synthetic_store(path, count, dimension=768, dtype="float32", quantize=None, seed=0, writers=()):
+    """Publish a store of `count` random chunks with packed synthetic texts; returns the version directory."""
+    embeddings = random_unit_rows(count, dimension, seed)
+    texts = [synthetic_text(i) for i in range(count)]
+    metadata = [
+        {"file": f"chunk_{i + 1:07d}", "post_url": texts[i].split("\n")[1].replace("**Post URL**: ", ""), "preview": f"Synthetic post {i}"}
+        for i in range(count)
+    ]
+    return write_store(path, embeddings, metadata, model="synthetic", dtype=dtype, quantize=quantize,
+                       writers=[content_pack_writer(texts), *writers])
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+def emit(benchmark, results, output=None):
+    """Write results as JSON to `output`, or stdout."""
+    report = {"benchmark": benchmark, "environment": environment(), "results": results}
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return report
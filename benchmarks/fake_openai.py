@@ -0,0 +1,107 @@
+"""Local stand-in for the OpenAI-compatible proxy and Ollama, with configurable latency.
+
+Serves /v1/embeddings, /v1/chat/completions and Ollama's /api/embed.
+Embeddings are deterministic unit vectors seeded by a hash of the text, so
+repeated texts embed identically. Run it on its own with
+
+    python benchmarks/fake_openai.py --port 8900 --chat-latency 0.8
+
+or start it in-process with serve_in_thread().
+"""
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+import threading
+import numpy as np
+from fastapi import FastAPI, Request
+
+def fake_embedding(text, dimension):
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimension, dtype=np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+def make_app(embed_latency=0.05, chat_latency=0.5, jitter=0.2, dimension=768):
+    """Create the fake API; each call sleeps its latency scaled by up to +/- `jitter`."""
+    app = FastAPI()
+    app.state.calls = {"embeddings": 0, "chat": 0, "ollama_embed": 0}
+
+    async def delay(latency):
+        if latency > 0:
+            await asyncio.sleep(latency * (1 + random.uniform(-jitter, jitter)))
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        app.state.calls["embeddings"] += 1
+        await delay(embed_latency)
+        return {
+            "object": "list",
+            "model": body.get("model", "fake"),
+            "data": [
+                {"object": "embedding", "index": i, "embedding": fake_embedding(text, body.get("dimensions") or dimension)}
+                for i, text in enumerate(inputs)
+            ],
+            "usage": {"prompt_tokens": sum(len(text) // 4 for text in inputs), "total_tokens": sum(len(text) // 4 for text in inputs)},
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.calls["chat"] += 1
+        await delay(chat_latency)
+        prompt_tokens = sum(len(str(message.get("content", ""))) // 4 for message in body.get("messages", []))
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "This is a synthetic answer from the benchmark server."},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 12, "total_tokens": prompt_tokens + 12},
+        }
+
+    @app.post("/api/embed")
+    async def ollama_embed(request: Request):
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        app.state.calls["ollama_embed"] += 1
+        await delay(embed_latency)
+        return {"model": body.get("model", "fake"), "embeddings": [fake_embedding(text, dimension) for text in inputs]}
+
+    return app
+
+def serve_in_thread(app, host="127.0.0.1", port=0):
+    """Serve an ASGI app with uvicorn on a background thread; returns (server, base_url) once it is up."""
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("Benchmark server failed to start")
+        time.sleep(0.01)
+    bound_port = server.servers[0].sockets[0].getsockname()[1]
+    return server, f"http://{host}:{bound_port}"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the fake OpenAI-compatible and Ollama API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="Seconds per embeddings call")
+    parser.add_argument("--chat-latency", type=float, default=0.5, help="Seconds per chat completion")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Relative latency jitter")
+    args = parser.parse_args(argv)
+
+    import uvicorn
+
+    uvicorn.run(make_app(args.embed_latency, args.chat_latency, args.jitter), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
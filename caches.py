@@ -0,0 +1,252 @@
+import re
+import time
+import asyncio
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+
+class LRUCache:
+    """Thread-safe in-memory LRU cache bounded by entry count, with hit/miss counters."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+def normalize_question(text):
+    """Normalize question text for cache keys: NFKC, casefolded, whitespace collapsed."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip().casefold()
+
+class EmbeddingCache:
+    """Query embedding cache: an in-memory LRU in front of an optional SQLite tier.
+
+    Keys hash the normalized question together with the embedding model and
+    dimension, so changing either never returns a stale vector. The disk tier
+    survives restarts and is trimmed to `disk_max_entries` least recently used
+    rows. Its reads and writes block, so async callers run them in a worker
+    thread; disk hits only note their access time, and those used_at updates
+    are written in batches together with the next puts.
+    """
+
+    # Puts between trims of the disk tier
+    TRIM_EVERY = 256
+    # Disk hits whose used_at updates are held before they are written
+    TOUCH_EVERY = 64
+
+    def __init__(self, model, dimensions, max_entries=2048, disk_path=None, disk_max_entries=100000):
+        self.model = model
+        self.dimensions = dimensions
+        self.memory = LRUCache(max_entries)
+        self.disk_path = disk_path
+        self.disk_max_entries = disk_max_entries
+        self.disk_hits = 0
+        self._puts = 0
+        self._touched = {}
+        self._db = None
+        self._db_lock = threading.Lock()
+        if disk_path:
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, used_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_used_at ON embeddings (used_at)")
+            self._db.commit()
+
+    def key(self, text):
+        raw = f"{self.model}\0{self.dimensions}\0{normalize_question(text)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, text):
+        """Return the cached float32 embedding for `text`, or None."""
+        key = self.key(text)
+        embedding = self.memory.get(key)
+        if embedding is not None or self._db is None:
+            return embedding
+        with self._db_lock:
+            row = self._db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._touched[key] = time.time()
+                if len(self._touched) >= self.TOUCH_EVERY:
+                    self._flush_touches()
+                    self._db.commit()
+        if row is None:
+            return None
+        embedding = np.frombuffer(row[0], dtype="<f4")
+        self.disk_hits += 1
+        self.memory.put(key, embedding)
+        return embedding
+
+    def get_many(self, texts):
+        """Return the cached embedding (or None) of each text, in order."""
+        return [self.get(text) for text in texts]
+
+    def put(self, text, embedding):
+        self.put_many([(text, embedding)])
+
+    def put_many(self, items):
+        """Cache (text, embedding) pairs, writing them to the disk tier in one transaction."""
+        rows = []
+        for text, embedding in items:
+            key = self.key(text)
+            embedding = np.array(embedding, dtype="<f4")
+            embedding.flags.writeable = False
+            self.memory.put(key, embedding)
+            rows.append((key, embedding.tobytes(), time.time()))
+        if self._db is None or not rows:
+            return
+        with self._db_lock:
+            self._flush_touches()
+            self._db.executemany("INSERT OR REPLACE INTO embeddings (key, vector, used_at) VALUES (?, ?, ?)", rows)
+            trim = (self._puts + len(rows)) // self.TRIM_EVERY > self._puts // self.TRIM_EVERY
+            self._puts += len(rows)
+            if trim:
+                # Drops everything at or below the used_at of the first row past the limit, via the used_at index
+                self._db.execute(
+                    "DELETE FROM embeddings WHERE used_at <= (SELECT used_at FROM embeddings ORDER BY used_at DESC LIMIT 1 OFFSET ?)",
+                    (self.disk_max_entries,),
+                )
+            self._db.commit()
+
+    def _flush_touches(self):
+        """Write the pending used_at updates of disk hits; the caller holds _db_lock and commits."""
+        if self._touched:
+            self._db.executemany("UPDATE embeddings SET used_at = ? WHERE key = ?", [(used_at, key) for key, used_at in self._touched.items()])
+            self._touched.clear()
+
+    def stats(self):
+        """Return hit/miss counters; misses are queries that needed an API call."""
+        return {
+            "entries": len(self.memory),
+            "memory_hits": self.memory.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.memory.misses - self.disk_hits,
+        }
+
+    def close(self):
+        if self._db is not None:
+            with self._db_lock:
+                self._flush_touches()
+                self._db.commit()
+                self._db.close()
+                self._db = None
+            logging.info(f"Embedding cache closed: {self.stats()}")
+
+class SemanticAnswerCache:
+    """Answer cache keyed by query embedding.
+
+    A lookup hits when a cached question's normalized embedding is within
+    `threshold` cosine similarity of the new one, the same top chunks were
+    retrieved, the entry is younger than `ttl` seconds and it was produced
+    against the same store version. Entries live in a fixed ring of slots so a
+    lookup is one small matrix-vector product.
+    """
+
+    def __init__(self, threshold=0.95, ttl=600, max_entries=1024):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._vectors = None
+        self._entries = [None] * max_entries
+        self._next_slot = 0
+        self._lock = threading.Lock()
+
+    def get(self, embedding, chunk_ids, store_version):
+        """Return the cached (answer, links) for a similar question, or None."""
+        if self.max_entries <= 0:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            if self._vectors is not None:
+                similarities = np.dot(self._vectors, embedding)
+                for slot in np.argsort(similarities)[::-1]:
+                    if similarities[slot] < self.threshold:
+                        break
+                    entry = self._entries[slot]
+                    if entry is None or entry["expires_at"] < now:
+                        continue
+                    if entry["chunk_ids"] == chunk_ids and entry["store_version"] == store_version:
+                        self.hits += 1
+                        return entry["answer"], entry["links"]
+            self.misses += 1
+            return None
+
+    def put(self, embedding, chunk_ids, store_version, answer, links):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, len(embedding)), dtype=np.float32)
+            slot = self._next_slot
+            self._next_slot = (slot + 1) % self.max_entries
+            self._vectors[slot] = embedding
+            self._entries[slot] = {
+                "chunk_ids": chunk_ids,
+                "store_version": store_version,
+                "answer": answer,
+                "links": links,
+                "expires_at": time.monotonic() + self.ttl,
+            }
+
+    def clear(self):
+        """Drop every entry, e.g. when a new store version is loaded."""
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors[:] = 0
+            self._entries = [None] * self.max_entries
+            self._next_slot = 0
+
+class RequestCoalescer:
+    """Let identical concurrent requests share one in-flight coroutine.
+
+    The first caller for a key starts the work as a task; later callers with
+    the same key await that task instead of starting their own. The task is
+    shielded, so a disconnecting client does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._pending = {}
+
+    async def run(self, key, factory):
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._pending[key] = task
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
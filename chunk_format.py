@@ -0,0 +1,18 @@
+import re
+import logging
+
+def extract_content_preview(content):
+    """Extract concise content preview after metadata."""
+    try:
+        lines = content.split("\n")
+        content_start = 0
+        for i, line in enumerate(lines):
+            if line.startswith("- **Content**:"):
+                content_start = i + 1
+                break
+        preview = " ".join(lines[content_start:]).strip()[:200]
+        preview = re.sub(r'<[^>]+>', '', preview)  # Remove HTML tags
+        return preview + "..." if len(preview) == 200 else preview
+    except Exception as e:
+        logging.error(f"Error extracting preview: {str(e)}")
+        return content[:200] + "..."
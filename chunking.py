@@ -1,65 +1,210 @@
 import os
 import re
-
-# Initialize logs
-error_log = []
-debug_log = []
+import json
+import argparse
 
 # Input and output paths
 input_file = "forum_posts.md"
 output_dir = "chunks"
-os.makedirs(output_dir, exist_ok=True)
-
-# Read the Markdown file
-try:
-    with open(input_file, "r", encoding="utf-8") as f:
-        markdown_content = f.read()
-except FileNotFoundError:
-    error_log.append(f"Input file {input_file} not found")
-    print(f"Error: Input file {input_file} not found")
-    with open("chunk_error_log.txt", "w", encoding="utf-8") as f:
-        f.write("\n".join(error_log))
-    exit(1)
-
-# Split content into chunks based on '### Post' header
-post_pattern = r'^### Post \d+\n'
-posts = re.split(post_pattern, markdown_content, flags=re.MULTILINE)
-post_headers = re.findall(post_pattern, markdown_content, flags=re.MULTILINE)
-
-# Skip the file header (e.g., '# Forum Posts')
-if posts and not posts[0].strip().startswith("**Post URL**"):
-    posts = posts[1:]
-    post_headers = post_headers[:len(posts)]
-
-# Process each post
-chunk_count = 0
-for i, (header, post_content) in enumerate(zip(post_headers, posts), 1):
-    if not post_content.strip():
-        debug_log.append(f"Skipping empty post section {i}")
-        continue
-    
-    full_post = header + post_content
-    
-    if not full_post.lstrip(header).strip().startswith("**Post URL**:"):
-        error_log.append(f"Post {i} missing or misplaced **Post URL**")
-        print(f"Error: Post {i} missing or misplaced **Post URL**")
-        continue
-    
-    chunk_filename = os.path.join(output_dir, f"chunk_{str(chunk_count + 1).zfill(3)}.md")
+shard_dirname = "shards"
+INDEX_FILE = "index.jsonl"
+# Shards are closed once they reach this many bytes
+MAX_SHARD_BYTES = 4 * 1024 * 1024
+
+POST_HEADER_PATTERN = re.compile(r"^### Post \d+$")
+CHUNK_ID_PATTERN = re.compile(r"^chunk_(\d+)$")
+CHUNK_FILE_PATTERN = re.compile(r"^chunk_(\d+)\.md$")
+
+def iter_posts(lines):
+    """Yield (post_number, text) for every '### Post N' section of a Markdown stream.
+
+    Reads one line at a time; text before the first post header (the file
+    header) is skipped, and each post runs until the next post header.
+    """
+    current = None
+    post_number = 0
+    for line in lines:
+        if POST_HEADER_PATTERN.match(line.rstrip("\n")):
+            if current is not None:
+                yield post_number, "".join(current)
+            post_number += 1
+            current = [line]
+        elif current is not None:
+            current.append(line)
+    if current is not None:
+        yield post_number, "".join(current)
+
+def post_url_of(text):
+    """Return the post URL of a chunk whose second line is '**Post URL**: ...', or None."""
+    lines = text.split("\n", 2)
+    if len(lines) < 2 or not lines[1].startswith("**Post URL**:"):
+        return None
+    return lines[1].replace("**Post URL**: ", "").strip() or None
+
+class ShardWriter:
+    """Append chunks to size-capped shard files and record where each one lives.
+
+    With `append`, the existing index is kept and writing continues at the
+    end of its last shard.
+    """
+
+    def __init__(self, shard_dir, max_bytes=MAX_SHARD_BYTES, append=False):
+        self.shard_dir = shard_dir
+        self.max_bytes = max_bytes
+        self.entries = read_shard_index(shard_dir) if append else []
+        self._shard_number = -1
+        self._file = None
+        self._offset = 0
+        os.makedirs(shard_dir, exist_ok=True)
+        if self.entries:
+            self._shard = self.entries[-1]["shard"]
+            self._shard_number = int(self._shard[len("shard_"):-len(".md")])
+            path = os.path.join(shard_dir, self._shard)
+            self._file = open(path, "ab")
+            self._offset = os.path.getsize(path)
+
+    def _open_next(self):
+        if self._file is not None:
+            self._file.close()
+        self._shard_number += 1
+        self._shard = f"shard_{self._shard_number:05d}.md"
+        self._file = open(os.path.join(self.shard_dir, self._shard), "wb")
+        self._offset = 0
+
+    def write(self, chunk_id, text, post_url):
+        data = text.encode("utf-8")
+        if self._file is None or (self._offset and self._offset + len(data) > self.max_bytes):
+            self._open_next()
+        self._file.write(data)
+        self.entries.append({
+            "id": chunk_id,
+            "shard": self._shard,
+            "offset": self._offset,
+            "length": len(data),
+            "post_url": post_url,
+        })
+        self._offset += len(data)
+
+    def close(self):
+        """Close the last shard, drop stale shards and write index.jsonl atomically."""
+        if self._file is not None:
+            self._file.close()
+        live = {entry["shard"] for entry in self.entries}
+        for name in os.listdir(self.shard_dir):
+            if name.startswith("shard_") and name not in live:
+                os.remove(os.path.join(self.shard_dir, name))
+        tmp_path = os.path.join(self.shard_dir, f"{INDEX_FILE}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in self.entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, os.path.join(self.shard_dir, INDEX_FILE))
+
+def read_shard_index(shard_dir):
+    """Return the index entries of a shard directory, or [] if it has no index."""
     try:
-        with open(chunk_filename, "w", encoding="utf-8") as f:
-            f.write(full_post)
-        chunk_count += 1
-        debug_log.append(f"Created chunk {chunk_filename} for Post {i}")
-    except Exception as e:
-        error_log.append(f"Failed to write chunk {chunk_filename}: {str(e)}")
-        print(f"Error writing chunk {chunk_filename}: {str(e)}")
-
-with open("chunk_error_log.txt", "w", encoding="utf-8") as f:
-    f.write("\n".join(error_log))
-with open("chunk_debug_log.txt", "w", encoding="utf-8") as f:
-    f.write("\n".join(debug_log))
-
-print(f"Chunking complete. {chunk_count} chunks created in '{output_dir}'.")
-print(f"Error log written to 'chunk_error_log.txt'. {len(error_log)} issues encountered.")
-print(f"Debug log written to 'chunk_debug_log.txt'. {len(debug_log)} entries logged.")
\ No newline at end of file
+        with open(os.path.join(shard_dir, INDEX_FILE), "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+def read_shard_chunk(shard_dir, shard, offset, length):
+    """Read one chunk's text from its shard."""
+    with open(os.path.join(shard_dir, shard), "rb") as f:
+        f.seek(offset)
+        return f.read(length).decode("utf-8")
+
+def read_chunk_text(chunks_dir, entry):
+    """Read a chunk described by a store metadata entry, from its shard or its own file."""
+    if entry.get("shard"):
+        return read_shard_chunk(os.path.join(chunks_dir, shard_dirname), entry["shard"], entry["offset"], entry["length"])
+    with open(os.path.join(chunks_dir, entry["file"]), "r", encoding="utf-8") as f:
+        return f.read()
+
+def iter_shard_chunks(shard_dir):
+    """Yield (entry, text) for every chunk in a shard directory, reading each shard sequentially."""
+    current_shard, handle = None, None
+    try:
+        for entry in read_shard_index(shard_dir):
+            if entry["shard"] != current_shard:
+                if handle is not None:
+                    handle.close()
+                current_shard = entry["shard"]
+                handle = open(os.path.join(shard_dir, current_shard), "rb")
+            handle.seek(entry["offset"])
+            yield entry, handle.read(entry["length"]).decode("utf-8")
+    finally:
+        if handle is not None:
+            handle.close()
+
+def last_chunk_id(destination, entries=()):
+    """Return the highest chunk number among shard index `entries` and the chunk_NNNNNN.md files in `destination`, or 0."""
+    names = os.listdir(destination) if os.path.isdir(destination) else []
+    matches = [CHUNK_ID_PATTERN.match(entry["id"]) for entry in entries] + [CHUNK_FILE_PATTERN.match(name) for name in names]
+    return max((int(match.group(1)) for match in matches if match), default=0)
+
+def chunk_markdown(source, destination=output_dir, max_shard_bytes=MAX_SHARD_BYTES, as_files=False, append=False):
+    """Split a forum Markdown file into one chunk per post.
+
+    Chunks are written to size-capped shards under `destination`/shards with
+    an index.jsonl of (id, shard, offset, length, post_url). With `append`
+    the chunks are added after the existing shards and numbered after the
+    highest existing chunk id. With `as_files` each chunk becomes its own
+    `chunk_NNNNNN.md` instead. A full sharded run removes per-post files
+    left by earlier runs; appending keeps them.
+    Returns (chunk_count, errors) for the chunks written by this call.
+    """
+    errors = []
+    chunk_count = 0
+    writer = None if as_files else ShardWriter(os.path.join(destination, shard_dirname), max_shard_bytes, append=append)
+    # Appended chunks are numbered after every existing shard entry and chunk file
+    first_id = last_chunk_id(destination, writer.entries if writer is not None else ()) + 1 if append else 1
+    os.makedirs(destination, exist_ok=True)
+    with open(source, "r", encoding="utf-8") as f:
+        for i, text in iter_posts(f):
+            post_url = post_url_of(text)
+            if post_url is None:
+                errors.append(f"Post {i} missing or misplaced **Post URL**")
+                continue
+            chunk_id = f"chunk_{first_id + chunk_count:06d}"
+            if writer is not None:
+                writer.write(chunk_id, text, post_url)
+            else:
+                with open(os.path.join(destination, f"{chunk_id}.md"), "w", encoding="utf-8") as out:
+                    out.write(text)
+            chunk_count += 1
+    if writer is not None:
+        writer.close()
+    # Per-post chunk files from earlier runs would duplicate rebuilt shards; an
+    # append only adds new posts, so those files still hold the older ones
+    stale = [] if as_files or append else [name for name in os.listdir(destination) if CHUNK_FILE_PATTERN.match(name)]
+    for name in stale:
+        os.remove(os.path.join(destination, name))
+    if stale:
+        print(f"Removed {len(stale)} per-post chunk files superseded by shards.")
+    return chunk_count, errors
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Split forum_posts.md into one chunk per post.")
+    parser.add_argument("--input", default=input_file, help="Forum Markdown file")
+    parser.add_argument("--output-dir", default=output_dir, help="Chunk directory")
+    parser.add_argument("--max-shard-bytes", type=int, default=MAX_SHARD_BYTES, help="Size cap of each shard file")
+    parser.add_argument("--files", action="store_true", help="Write one file per chunk instead of shards")
+    parser.add_argument("--append", action="store_true", help="Add the chunks after the existing shards (or chunk files with --files)")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.input):
+        print(f"Error: Input file {args.input} not found")
+        with open("chunk_error_log.txt", "w", encoding="utf-8") as f:
+            f.write(f"Input file {args.input} not found")
+        exit(1)
+
+    chunk_count, errors = chunk_markdown(args.input, args.output_dir, args.max_shard_bytes, as_files=args.files, append=args.append)
+    with open("chunk_error_log.txt", "w", encoding="utf-8") as f:
+        f.write("\n".join(errors))
+
+    where = args.output_dir if args.files else os.path.join(args.output_dir, shard_dirname)
+    print(f"Chunking complete. {chunk_count} chunks created in '{where}'.")
+    print(f"Error log written to 'chunk_error_log.txt'. {len(errors)} issues encountered.")
+
+if __name__ == "__main__":
+    main()
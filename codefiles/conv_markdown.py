@@ -1,116 +1,181 @@
 import os
 import json
-from datetime import datetime
-import pytz
+import argparse
+import tempfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
 
+# Default date window of the forum posts to convert
+DEFAULT_START = datetime(2025, 1, 1, tzinfo=timezone.utc)
+DEFAULT_END = datetime(2025, 4, 14, 23, 59, 59, tzinfo=timezone.utc)
 
-markdown = "# Forum Posts (January 1, 2025 - April 14, 2025)\n\n"
+def parse_datetime(value):
+    """Parse an ISO 8601 timestamp (with a trailing Z or no zone) as an aware UTC datetime."""
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
 
+def parse_end_datetime(value):
+    """Parse an inclusive upper bound like parse_datetime; a date alone means 23:59:59 of that day."""
+    # "2025-04-14" would otherwise parse as midnight and drop that day's posts
+    if len(value) == 10:
+        value = f"{value}T23:59:59"
+    return parse_datetime(value)
 
-error_log = []
-debug_log = []
+def format_date(value):
+    return f"{value:%B} {value.day}, {value.year}"
 
+def render_post(post):
+    """Render one post in the forum_posts.md format."""
+    lines = [
+        f"### Post {post['post_number']}\n",
+        f"**Post URL**: {post['post_url']}\n",
+        f"- **ID**: {post['id']}\n",
+        f"- **Author**: {post['name']} ({post['username']})\n",
+        f"- **Created At**: {post['created_at']}\n",
+    ]
+    if post.get("reply_to_post_number"):
+        reply_user = post.get("reply_to_user", {})
+        lines.append(f"- **Reply To**: Post {post['reply_to_post_number']} ({reply_user.get('name', '')}, {reply_user.get('username', '')})\n")
+    lines.append(f"- **Content**:  \n  {post['cooked'].replace('<p>', '').replace('</p>', '')}\n")
+    reactions = ', '.join([f"{r['id']} ({r['count']})" for r in post.get('reactions', [])]) if post.get('reactions') else 'None'
+    lines.append(f"- **Reactions**: {reactions}\n")
+    lines.append(f"- **Post Number**: {post['post_number']}\n\n")
+    return "".join(lines)
 
-start_date = datetime(2025, 1, 1, tzinfo=pytz.UTC)
-end_date = datetime(2025, 4, 14, 23, 59, 59, tzinfo=pytz.UTC)
+def render_topic_header(topic_id, slug):
+    return (
+        f"## Topic: {slug.replace('-', ' ').title()}\n"
+        f"**Topic ID**: {topic_id}\n"
+        f"**Topic Slug**: {slug}\n\n"
+    )
 
-for root, dirs, files in os.walk("sc"):
-    json_files = [f for f in files if f.endswith(".json")]
-    
+def parse_topic_file(file_path, start_date=DEFAULT_START, end_date=DEFAULT_END):
+    """Parse one scraped JSON file and render its posts inside the date window.
 
+    Returns (topics, counters, errors) where topics maps topic_id to
+    {"slug", "posts": [(post_number, rendered_markdown)]}. Runs in a worker
+    process, so it only returns plain data.
+    """
+    file = os.path.basename(file_path)
     topics = {}
-    
-    # Process each JSON file
-    for file in json_files:
-        file_path = os.path.join(root, file)
+    counters = Counter(files=1)
+    errors = []
+    try:
         with open(file_path, "r", encoding="utf-8") as f:
-            try:
-                posts = json.load(f)
-                # Ensure posts is a list
-                if not isinstance(posts, list):
-                    error_log.append(f"Skipping {file}: Expected a list of posts")
-                    print(f"Skipping {file}: Expected a list of posts")
-                    continue
-                
-                # Group posts by topic_id
-                for post in posts:
-                    topic_id = post.get("topic_id")
-                    # Skip posts with None or invalid topic_id
-                    if topic_id is None or not isinstance(topic_id, (int, str)):
-                        error_log.append(f"Skipping post in {file}: Invalid topic_id {topic_id}")
-                        print(f"Skipping post in {file}: Invalid topic_id {topic_id}")
-                        continue
-                    
-
-                    created_at_str = post.get("created_at")
-                    try:
-
-                        created_at = datetime.fromisoformat(created_at_str.replace("Z", "+00:00"))
-
-                        if created_at.tzinfo is None:
-                            created_at = created_at.replace(tzinfo=pytz.UTC)
-                        
-                        # Log for debugging
-                        debug_log.append(f"Post in {file}: created_at={created_at}, start_date={start_date}, end_date={end_date}")
-                        
-                        # Check if post is within date range
-                        if not (start_date <= created_at <= end_date):
-                            debug_log.append(f"Skipping post in {file}: created_at {created_at} outside range {start_date} to {end_date}")
-                            print(f"Skipping post in {file}: created_at {created_at} outside range")
-                            continue
-                    except (ValueError, TypeError) as e:
-                        error_log.append(f"Skipping post in {file}: Invalid created_at {created_at_str}: {str(e)}")
-                        print(f"Skipping post in {file}: Invalid created_at {created_at_str}: {str(e)}")
-                        continue
-                    
-                    if topic_id not in topics:
-                        topics[topic_id] = {
-                            "slug": post.get("topic_slug", "unknown-topic"),
-                            "posts": []
-                        }
-                    topics[topic_id]["posts"].append(post)
-            except json.JSONDecodeError as e:
-                error_log.append(f"Error decoding JSON in {file}: {str(e)}")
-                print(f"Error decoding JSON in {file}: {str(e)}")
-                continue
-    
-    # Sort topics by topic_id (convert to string for safety if mixed types exist)
-    for topic_id in sorted(topics.keys(), key=lambda x: str(x)):
-        topic = topics[topic_id]
-        slug = topic["slug"].replace("-", " ").title()
-        markdown += f"## Topic: {slug}\n"
-        markdown += f"**Topic ID**: {topic_id}\n"
-        markdown += f"**Topic Slug**: {topic['slug']}\n\n"
-        
-        # Sort posts by post_number
-        sorted_posts = sorted(topic["posts"], key=lambda x: x.get("post_number", 0))
-        
-        for post in sorted_posts:
-            markdown += f"### Post {post['post_number']}\n"
-            markdown += f"**Post URL**: {post['post_url']}\n"
-            markdown += f"- **ID**: {post['id']}\n"
-            markdown += f"- **Author**: {post['name']} ({post['username']})\n"
-            markdown += f"- **Created At**: {post['created_at']}\n"
-            if post.get("reply_to_post_number"):
-                reply_user = post.get("reply_to_user", {})
-                markdown += f"- **Reply To**: Post {post['reply_to_post_number']} ({reply_user.get('name', '')}, {reply_user.get('username', '')})\n"
-            markdown += f"- **Content**:  \n  {post['cooked'].replace('<p>', '').replace('</p>', '')}\n"
-            reactions = ', '.join([f"{r['id']} ({r['count']})" for r in post.get('reactions', [])]) if post.get('reactions') else 'None'
-            markdown += f"- **Reactions**: {reactions}\n"
-            markdown += f"- **Post Number**: {post['post_number']}\n\n"
-
-# Write to output Markdown file
-with open("forum_posts.md", "w", encoding="utf-8") as f:
-    f.write(markdown)
-
-# Write error log to a file
-with open("error_log.txt", "w", encoding="utf-8") as f:
-    f.write("\n".join(error_log))
-
-# Write debug log to a file
-with open("debug_log.txt", "w", encoding="utf-8") as f:
-    f.write("\n".join(debug_log))
-
-print("Markdown file 'forum_posts.md' generated successfully.")
-print(f"Error log written to 'error_log.txt'. {len(error_log)} issues encountered.")
-print(f"Debug log written to 'debug_log.txt'. {len(debug_log)} entries logged.")
\ No newline at end of file
+            posts = json.load(f)
+    except json.JSONDecodeError as e:
+        counters["files_invalid"] += 1
+        errors.append(f"Error decoding JSON in {file}: {str(e)}")
+        return topics, counters, errors
+    # Ensure posts is a list
+    if not isinstance(posts, list):
+        counters["files_invalid"] += 1
+        errors.append(f"Skipping {file}: Expected a list of posts")
+        return topics, counters, errors
+
+    for post in posts:
+        topic_id = post.get("topic_id")
+        # Skip posts with None or invalid topic_id
+        if topic_id is None or not isinstance(topic_id, (int, str)):
+            counters["posts_invalid_topic"] += 1
+            continue
+
+        created_at_str = post.get("created_at")
+        try:
+            created_at = parse_datetime(created_at_str)
+        except (ValueError, TypeError, AttributeError) as e:
+            counters["posts_invalid_date"] += 1
+            errors.append(f"Skipping post in {file}: Invalid created_at {created_at_str}: {str(e)}")
+            continue
+        # Check if post is within date range
+        if not (start_date <= created_at <= end_date):
+            counters["posts_out_of_range"] += 1
+            continue
+
+        try:
+            rendered = render_post(post)
+        except KeyError as e:
+            counters["posts_invalid"] += 1
+            errors.append(f"Skipping post in {file}: missing field {str(e)}")
+            continue
+        topic = topics.setdefault(topic_id, {"slug": post.get("topic_slug", "unknown-topic"), "posts": []})
+        topic["posts"].append((post.get("post_number", 0), rendered))
+        counters["posts_kept"] += 1
+    return topics, counters, errors
+
+def _parse_topic_file(args):
+    return parse_topic_file(*args)
+
+def list_json_files(input_dir):
+    """Return every .json file under `input_dir`, sorted for a deterministic output order."""
+    json_files = []
+    for root, dirs, files in os.walk(input_dir):
+        json_files.extend(os.path.join(root, f) for f in files if f.endswith(".json"))
+    return sorted(json_files)
+
+def convert(input_dir="sc", output="forum_posts.md", start_date=DEFAULT_START, end_date=DEFAULT_END, workers=None, header=True):
+    """Convert scraped forum JSON under `input_dir` into one Markdown file.
+
+    Files are parsed and rendered in a process pool. A topic can span several
+    files, so each rendered post is spilled to a temporary file as it
+    arrives and only its topic, post number, offset and length are kept.
+    Topics are then written to `output` one at a time, ordered by topic id
+    with posts in post-number order, reading back one topic's posts at a
+    time. Returns (counters, errors).
+    """
+    json_files = list_json_files(input_dir)
+    # topic_id -> {"slug", "posts": [(post_number, offset, length)]}
+    topics = {}
+    counters = Counter()
+    errors = []
+    tasks = [(path, start_date, end_date) for path in json_files]
+    with tempfile.TemporaryFile() as spill:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for file_topics, file_counters, file_errors in executor.map(_parse_topic_file, tasks, chunksize=8):
+                counters.update(file_counters)
+                errors.extend(file_errors)
+                for topic_id, topic in file_topics.items():
+                    entry = topics.setdefault(topic_id, {"slug": topic["slug"], "posts": []})
+                    for post_number, rendered in topic["posts"]:
+                        data = rendered.encode("utf-8")
+                        entry["posts"].append((post_number, spill.tell(), len(data)))
+                        spill.write(data)
+
+        with open(output, "w", encoding="utf-8") as f:
+            if header:
+                f.write(f"# Forum Posts ({format_date(start_date)} - {format_date(end_date)})\n\n")
+            # Sort topics by topic_id (convert to string for safety if mixed types exist)
+            for topic_id in sorted(topics.keys(), key=lambda x: str(x)):
+                topic = topics.pop(topic_id)
+                f.write(render_topic_header(topic_id, topic["slug"]))
+                for _, offset, length in sorted(topic["posts"], key=lambda post: post[0]):
+                    spill.seek(offset)
+                    f.write(spill.read(length).decode("utf-8"))
+                counters["topics"] += 1
+    return counters, errors
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert scraped Discourse JSON into forum_posts.md.")
+    parser.add_argument("--input-dir", default="sc", help="Directory of scraped topic JSON files")
+    parser.add_argument("--output", default="forum_posts.md", help="Markdown file to write")
+    parser.add_argument("--start", type=parse_datetime, default=DEFAULT_START, help="Earliest post time (ISO 8601, UTC if no zone)")
+    parser.add_argument("--end", type=parse_end_datetime, default=DEFAULT_END, help="Latest post time (ISO 8601, UTC if no zone; a date alone means the end of that day)")
+    parser.add_argument("--workers", type=int, help="Parser processes (default: CPU count)")
+    parser.add_argument("--error-log", default="error_log.txt", help="File listing skipped files and posts")
+    args = parser.parse_args(argv)
+
+    counters, errors = convert(args.input_dir, args.output, args.start, args.end, args.workers)
+
+    # Write error log to a file
+    with open(args.error_log, "w", encoding="utf-8") as f:
+        f.write("\n".join(errors))
+
+    print(f"Markdown file '{args.output}' generated successfully.")
+    print(", ".join(f"{key}={value}" for key, value in sorted(counters.items())))
+    print(f"Error log written to '{args.error_log}'. {len(errors)} issues encountered.")
+
+if __name__ == "__main__":
+    main()
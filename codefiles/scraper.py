@@ -0,0 +1,251 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import httpx
+
+# Forum to crawl; point DISCOURSE_URL at a local server to exercise the crawler offline
+BASE_URL = os.environ.get("DISCOURSE_URL", "https://discourse.onlinedegree.iitm.ac.in")
+CATEGORY_PATH = "/c/courses/tds-kb/34.json"
+# Session cookie of a logged-in forum user, e.g. "_t=...; _forum_session=..."
+COOKIE = os.environ.get("DISCOURSE_COOKIE", "")
+
+# Requests in flight, request starts per second, retries per request and timeout (seconds)
+SCRAPE_CONCURRENCY = int(os.environ.get("SCRAPE_CONCURRENCY", "8"))
+SCRAPE_RATE = float(os.environ.get("SCRAPE_RATE", "4"))
+SCRAPE_RETRIES = 4
+SCRAPE_TIMEOUT = 30
+# Post ids requested per /t/{id}/posts.json call; Discourse serves 20 posts per chunk
+POSTS_PER_REQUEST = 20
+
+output_dir = "sc"
+checkpoint_path = "scrape_checkpoint.json"
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+class RateLimiter:
+    """Space request starts at least 1/rate seconds apart across all tasks."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+class Fetcher:
+    """Fetch JSON over a pooled client, bounded by a semaphore and a rate limiter, with retries."""
+
+    def __init__(self, client, concurrency=SCRAPE_CONCURRENCY, rate=SCRAPE_RATE, retries=SCRAPE_RETRIES):
+        self.client = client
+        self.slots = asyncio.Semaphore(concurrency)
+        self.limiter = RateLimiter(rate)
+        self.retries = retries
+        self.requests = 0
+
+    async def get_json(self, path, params=None):
+        """GET a JSON document, retrying transport errors, 429 and 5xx with exponential backoff."""
+        for attempt in range(self.retries + 1):
+            retry_after = None
+            try:
+                async with self.slots:
+                    await self.limiter.wait()
+                    self.requests += 1
+                    response = await self.client.get(path, params=params)
+                if response.status_code not in RETRY_STATUS:
+                    response.raise_for_status()
+                    return response.json()
+                error = f"HTTP {response.status_code}"
+                retry_after = response.headers.get("Retry-After")
+            except httpx.TransportError as e:
+                error = str(e) or type(e).__name__
+            if attempt == self.retries:
+                raise RuntimeError(f"GET {path} failed after {self.retries + 1} attempts: {error}")
+            try:
+                delay = float(retry_after)
+            except (TypeError, ValueError):
+                delay = 2 ** attempt + random.random()
+            logging.warning(f"GET {path} failed ({error}); retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+def make_client(base_url=BASE_URL, cookie=COOKIE, concurrency=SCRAPE_CONCURRENCY, timeout=SCRAPE_TIMEOUT):
+    """Create the pooled async client shared by every request of a crawl."""
+    headers = {"Accept": "application/json"}
+    if cookie:
+        headers["Cookie"] = cookie
+    return httpx.AsyncClient(
+        base_url=base_url,
+        headers=headers,
+        timeout=timeout,
+        limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+    )
+
+async def fetch_category(fetcher, category_path=CATEGORY_PATH, max_pages=None):
+    """Return every topic of a category listing, following its pages until one comes back empty."""
+    topics = []
+    page = 0
+    while max_pages is None or page < max_pages:
+        data = await fetcher.get_json(category_path, params={"page": page} if page else None)
+        topic_list = data.get("topic_list", {})
+        page_topics = topic_list.get("topics", [])
+        topics.extend(page_topics)
+        if not page_topics or not topic_list.get("more_topics_url"):
+            break
+        page += 1
+    return topics
+
+async def fetch_topic_posts(fetcher, topic_id, after_post_number=0, after_post_id=0):
+    """Return the posts of a topic in stream order.
+
+    The first request returns a window of posts together with
+    post_stream.stream, the ids of every post in the topic; the remaining ids
+    are then fetched in batches of POSTS_PER_REQUEST. With `after_post_number`
+    the first request starts at the next post and only posts numbered above it
+    are kept, while stream ids at or below `after_post_id` (posts already
+    saved, since ids grow over time) are never requested.
+    """
+    path = f"/t/{topic_id}/{after_post_number + 1}.json" if after_post_number else f"/t/{topic_id}.json"
+    data = await fetcher.get_json(path)
+    post_stream = data.get("post_stream", {})
+    posts = {post["id"]: post for post in post_stream.get("posts", [])}
+    missing = [post_id for post_id in post_stream.get("stream", []) if post_id not in posts and post_id > after_post_id]
+    batches = [missing[i:i + POSTS_PER_REQUEST] for i in range(0, len(missing), POSTS_PER_REQUEST)]
+    results = await asyncio.gather(*(
+        fetcher.get_json(f"/t/{topic_id}/posts.json", params=[("post_ids[]", post_id) for post_id in batch])
+        for batch in batches
+    ))
+    for result in results:
+        for post in result.get("post_stream", {}).get("posts", []):
+            posts[post["id"]] = post
+    order = post_stream.get("stream") or list(posts)
+    return [posts[post_id] for post_id in order if post_id in posts and posts[post_id].get("post_number", 0) > after_post_number]
+
+def load_checkpoint(path=checkpoint_path):
+    """Return the crawl checkpoint, {"topics": {topic_id: state}}, or an empty one."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"topics": {}}
+
+def save_checkpoint(checkpoint, path=checkpoint_path):
+    """Write the checkpoint atomically so an interrupted crawl never leaves it half written."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def read_topic(slug, destination=output_dir):
+    """Return the saved posts of a topic, or None if it has not been saved."""
+    try:
+        with open(os.path.join(destination, f"{slug}.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def write_topic(posts, slug, destination=output_dir):
+    os.makedirs(destination, exist_ok=True)
+    path = os.path.join(destination, f"{slug}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(posts, f, indent=2, ensure_ascii=False)
+    return path
+
+def topic_state(topic, posts):
+    """Checkpoint entry of a saved topic: listing counters plus its highest post number and id."""
+    return {
+        "slug": topic["slug"],
+        "file": f"{topic['slug']}.json",
+        "posts_count": topic.get("posts_count", len(posts)),
+        "bumped_at": topic.get("bumped_at"),
+        "highest_post_number": max((post.get("post_number", 0) for post in posts), default=0),
+        "last_post_id": max((post.get("id", 0) for post in posts), default=0),
+    }
+
+async def crawl(base_url=BASE_URL, category_path=CATEGORY_PATH, destination=output_dir, checkpoint_file=checkpoint_path,
+                concurrency=SCRAPE_CONCURRENCY, rate=SCRAPE_RATE, max_pages=None, cookie=COOKIE,
+                incremental=False, delta_dir=None):
+    """Crawl a category and write each topic's posts to `destination`/{slug}.json.
+
+    Every finished topic is recorded in the checkpoint with the listing's
+    posts_count and bumped_at, so a rerun skips topics already saved in the
+    same state and resumes with the rest. With `incremental`, a changed topic
+    that is already saved only fetches posts after its highest saved post
+    number and appends them to its file. New posts are also written to
+    `delta_dir`/{slug}.json when given, for incremental conversion. Topics
+    that still fail after retries are logged and left out of the checkpoint.
+    Returns (saved, skipped, failed, new_posts) counts.
+    """
+    checkpoint = load_checkpoint(checkpoint_file)
+    saved = skipped = failed = new_posts = 0
+    async with make_client(base_url, cookie, concurrency) as client:
+        fetcher = Fetcher(client, concurrency, rate)
+        topics = await fetch_category(fetcher, category_path, max_pages)
+        logging.info(f"Found {len(topics)} topics in {category_path}")
+
+        async def scrape(topic):
+            nonlocal saved, skipped, failed, new_posts
+            topic_id = str(topic["id"])
+            state = checkpoint["topics"].get(topic_id)
+            if state is not None and state.get("bumped_at") == topic.get("bumped_at") and state.get("posts_count") == topic.get("posts_count"):
+                skipped += 1
+                return
+            existing = read_topic(topic["slug"], destination) if incremental and state is not None else None
+            after_number = state.get("highest_post_number", 0) if existing is not None else 0
+            after_id = state.get("last_post_id", 0) if existing is not None else 0
+            try:
+                fetched = await fetch_topic_posts(fetcher, topic["id"], after_number, after_id)
+            except Exception as e:
+                failed += 1
+                logging.error(f"Failed to scrape topic {topic_id} ({topic.get('slug')}): {str(e)}")
+                return
+            posts = (existing or []) + fetched
+            write_topic(posts, topic["slug"], destination)
+            if delta_dir is not None and fetched:
+                write_topic(fetched, topic["slug"], delta_dir)
+            checkpoint["topics"][topic_id] = topic_state(topic, posts)
+            # Runs on the event loop thread, so checkpoint writes never interleave
+            save_checkpoint(checkpoint, checkpoint_file)
+            saved += 1
+            new_posts += len(fetched)
+            logging.info(f"Saved {len(fetched)} {'new ' if existing is not None else ''}posts of {topic['slug']}")
+
+        await asyncio.gather(*(scrape(topic) for topic in topics))
+        logging.info(f"Crawl finished: {saved} saved, {skipped} unchanged, {failed} failed, {new_posts} new posts, {fetcher.requests} requests")
+    return saved, skipped, failed, new_posts
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Crawl a Discourse category into per-topic JSON files.")
+    parser.add_argument("--base-url", default=BASE_URL, help="Forum base URL")
+    parser.add_argument("--category", default=CATEGORY_PATH, help="Category listing path")
+    parser.add_argument("--output-dir", default=output_dir, help="Directory for topic JSON files")
+    parser.add_argument("--checkpoint", default=checkpoint_path, help="Checkpoint file used to resume a crawl")
+    parser.add_argument("--concurrency", type=int, default=SCRAPE_CONCURRENCY, help="Requests in flight")
+    parser.add_argument("--rate", type=float, default=SCRAPE_RATE, help="Request starts per second (0 for no limit)")
+    parser.add_argument("--max-pages", type=int, help="Stop after this many category listing pages")
+    parser.add_argument("--incremental", action="store_true", help="Only fetch posts newer than those already saved")
+    parser.add_argument("--delta-dir", help="Also write each topic's new posts to this directory")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    saved, skipped, failed, new_posts = asyncio.run(crawl(
+        args.base_url, args.category, args.output_dir, args.checkpoint,
+        args.concurrency, args.rate, args.max_pages,
+        incremental=args.incremental, delta_dir=args.delta_dir,
+    ))
+    print(f"Saved {saved} topics ({new_posts} new posts), {skipped} unchanged, {failed} failed.")
+    if failed:
+        exit(1)
+
+if __name__ == "__main__":
+    main()
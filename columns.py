@@ -0,0 +1,108 @@
+import os
+import re
+import json
+import logging
+from datetime import datetime, timezone
+import numpy as np
+
+# Per-chunk metadata columns stored with a store version, one .npy file each
+CREATED_AT_FILE = "col_created_at.npy"  # int64 Unix seconds, -1 when unknown
+TOPIC_ID_FILE = "col_topic_id.npy"  # int64 Discourse topic id, -1 for course pages
+AUTHOR_FILE = "col_author.npy"  # int32 index into col_authors.json, -1 when unknown
+SOURCE_FILE = "col_source.npy"  # uint8 index into SOURCE_TYPES
+AUTHORS_FILE = "col_authors.json"
+SOURCE_TYPES = ("forum", "course")
+
+CREATED_AT_PATTERN = re.compile(r"^- \*\*Created At\*\*: (\S+)", re.MULTILINE)
+AUTHOR_PATTERN = re.compile(r"^- \*\*Author\*\*: .*\(([^()\s]+)\)\s*$", re.MULTILINE)
+TOPIC_URL_PATTERN = re.compile(r"^/t/[^/]+/(\d+)")
+
+def parse_created_at(text):
+    """Return the Unix time of a chunk's first '- **Created At**:' line, or -1."""
+    match = CREATED_AT_PATTERN.search(text)
+    if not match:
+        return -1
+    try:
+        created_at = datetime.fromisoformat(match.group(1).replace("Z", "+00:00"))
+    except ValueError:
+        return -1
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return int(created_at.timestamp())
+
+def extract_columns(texts, metadata):
+    """Parse (columns, authors) from chunk texts and metadata, in row order."""
+    authors = {}
+    created_at = np.full(len(texts), -1, dtype=np.int64)
+    topic_ids = np.full(len(texts), -1, dtype=np.int64)
+    author_ids = np.full(len(texts), -1, dtype=np.int32)
+    sources = np.zeros(len(texts), dtype=np.uint8)
+    for i, (text, entry) in enumerate(zip(texts, metadata)):
+        created_at[i] = parse_created_at(text)
+        match = TOPIC_URL_PATTERN.match(entry.get("post_url") or "")
+        if match:
+            topic_ids[i] = int(match.group(1))
+        else:
+            sources[i] = SOURCE_TYPES.index("course")
+        match = AUTHOR_PATTERN.search(text)
+        if match:
+            author_ids[i] = authors.setdefault(match.group(1).lower(), len(authors))
+    columns = {"created_at": created_at, "topic_id": topic_ids, "author": author_ids, "source": sources}
+    return columns, list(authors)
+
+def columns_writer(texts, metadata):
+    """Return a write_store writer that stores the created_at, topic_id, author and source columns."""
+    def write(version_dir, embeddings):
+        if len(texts) != len(embeddings) or len(metadata) != len(embeddings):
+            raise ValueError(f"Expected one text and metadata entry per embedding row, got {len(texts)} and {len(metadata)} for {len(embeddings)}")
+        columns, authors = extract_columns(texts, metadata)
+        np.save(os.path.join(version_dir, CREATED_AT_FILE), columns["created_at"])
+        np.save(os.path.join(version_dir, TOPIC_ID_FILE), columns["topic_id"])
+        np.save(os.path.join(version_dir, AUTHOR_FILE), columns["author"])
+        np.save(os.path.join(version_dir, SOURCE_FILE), columns["source"])
+        with open(os.path.join(version_dir, AUTHORS_FILE), "w", encoding="utf-8") as f:
+            json.dump(authors, f, ensure_ascii=False, separators=(",", ":"))
+        dated = int(np.count_nonzero(columns["created_at"] >= 0))
+        logging.info(f"Stored metadata columns: {dated}/{len(texts)} dated chunks, {len(authors)} authors")
+        return {"columns": sorted(columns)}
+    return write
+
+class MetadataColumns:
+    """Per-chunk metadata arrays of a store version, for filtering before top-k."""
+
+    def __init__(self, created_at, topic_id, author, source, authors):
+        self.created_at = created_at
+        self.topic_id = topic_id
+        self.author = author
+        self.source = source
+        self.author_ids = {name: i for i, name in enumerate(authors)}
+
+    @classmethod
+    def open(cls, version_dir, count):
+        arrays = [np.load(os.path.join(version_dir, name), mmap_mode="r") for name in (CREATED_AT_FILE, TOPIC_ID_FILE, AUTHOR_FILE, SOURCE_FILE)]
+        if any(len(array) != count for array in arrays):
+            raise ValueError(f"Invalid metadata columns in {version_dir}: expected {count} rows")
+        with open(os.path.join(version_dir, AUTHORS_FILE), "r", encoding="utf-8") as f:
+            authors = json.load(f)
+        return cls(*arrays, authors)
+
+    def mask(self, created_after=None, created_before=None, topic_ids=None, authors=None, sources=None):
+        """Return a boolean row mask of chunks passing every filter; filters left as None are not applied.
+
+        Dates are Unix seconds and bound created_at inclusively; chunks without
+        a date fail any date bound. Unknown authors and sources match nothing.
+        """
+        mask = np.ones(len(self.created_at), dtype=bool)
+        if created_after is not None:
+            mask &= self.created_at >= created_after
+        if created_before is not None:
+            mask &= (self.created_at >= 0) & (self.created_at <= created_before)
+        if topic_ids is not None:
+            mask &= np.isin(self.topic_id, np.asarray(topic_ids, dtype=np.int64))
+        if authors is not None:
+            ids = [self.author_ids[name.lower()] for name in authors if name.lower() in self.author_ids]
+            mask &= np.isin(self.author, np.asarray(ids, dtype=np.int32))
+        if sources is not None:
+            codes = [SOURCE_TYPES.index(source) for source in sources if source in SOURCE_TYPES]
+            mask &= np.isin(self.source, np.asarray(codes, dtype=np.uint8))
+        return mask
@@ -0,0 +1,132 @@
+import re
+import logging
+from collections import Counter
+import tiktoken
+from lexical import tokenize
+
+# Tokenizer of the chat model; the context budget is counted in its tokens. It is
+# loaded (and cached by tiktoken) on first use, so importing the patterns below is cheap
+ENCODING_NAME = "o200k_base"
+
+# Lines of the chunk Markdown format that carry no answerable content
+BOILERPLATE_PATTERN = re.compile(
+    r"^(### Post \d+|## Topic: .*|\*\*Topic ID\*\*: .*|\*\*Topic Slug\*\*: .*|\*\*Post URL\*\*: .*"
+    r"|- \*\*ID\*\*: .*|- \*\*Author\*\*: .*|- \*\*Reactions\*\*: .*|- \*\*Post Number\*\*: .*|- \*\*Content\*\*:\s*)$"
+)
+TAG_PATTERN = re.compile(r"<[^>]+>")
+# Discourse quote blocks repeat text from other posts, which are retrieved on their own
+QUOTE_PATTERN = re.compile(r"<aside class=\"quote.*?</aside>", re.DOTALL)
+TOPIC_URL_PATTERN = re.compile(r"^/t/[^/]+/(\d+)(?:/(\d+))?")
+# Tokens of the best passage kept when the budget cannot even cover the chunk headers
+MIN_CONTEXT_TOKENS = 64
+
+def count_tokens(text):
+    """Count the prompt tokens of text with the chat model's tiktoken encoding."""
+    return len(tiktoken.get_encoding(ENCODING_NAME).encode(text, disallowed_special=()))
+
+def clean_chunk(content):
+    """Drop metadata lines, quote blocks and HTML tags from a chunk, returning its passages."""
+    content = QUOTE_PATTERN.sub("", content)
+    passages, current = [], []
+    for line in content.split("\n"):
+        line = TAG_PATTERN.sub("", line).strip()
+        if BOILERPLATE_PATTERN.match(line):
+            continue
+        if not line:
+            if current:
+                passages.append(" ".join(current))
+                current = []
+            continue
+        current.append(line)
+    if current:
+        passages.append(" ".join(current))
+    return passages
+
+def rank_passages(passages, query_terms):
+    """Return passage indices ordered by query-term overlap, ties kept in reading order."""
+    scores = []
+    for i, passage in enumerate(passages):
+        terms = Counter(tokenize(passage))
+        overlap = sum(min(terms[term], 3) for term in query_terms)
+        scores.append((-overlap, i))
+    return [i for _, i in sorted(scores)]
+
+def truncate_to_tokens(text, budget):
+    """Cut text to at most `budget` tokens."""
+    if budget <= 0:
+        return ""
+    encoding = tiktoken.get_encoding(ENCODING_NAME)
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= budget else encoding.decode(tokens[:budget]) + " ..."
+
+def topic_key(chunk):
+    """Return (topic id, post number) parsed from a chunk's post URL, or (None, 0)."""
+    match = TOPIC_URL_PATTERN.match(chunk.get("post_url") or "")
+    if not match:
+        return None, 0
+    return match.group(1), int(match.group(2) or 1)
+
+def build_context(query, top_chunks, base_url, budget):
+    """Assemble prompt context from ranked chunks within a token budget.
+
+    Each chunk is reduced to its content passages. Every chunk first gets an
+    equal share of the budget, filled with its passages closest to the query.
+    Budget left over by short chunks then goes to the others in rank order.
+    Posts from the same topic are merged into one block in post order, under
+    the rank of their best post. If the budget is too small to fit any
+    passage, the top chunk's best passage is still kept, truncated to
+    MIN_CONTEXT_TOKENS, and a warning is logged. Returns (context, token_count).
+    """
+    query_terms = set(tokenize(query))
+    cleaned = [clean_chunk(chunk["content"]) for chunk in top_chunks]
+    orders = [rank_passages(passages, query_terms) for passages in cleaned]
+    costs = [[count_tokens(passage) for passage in passages] for passages in cleaned]
+    selected = [set() for _ in top_chunks]
+    used = [0] * len(top_chunks)
+    headers = [count_tokens(f"Post URL: {base_url}{chunk['post_url']}\nContent:\n\n\n") for chunk in top_chunks]
+    remaining = budget - sum(headers)
+
+    share = max(remaining // max(len(top_chunks), 1), 0)
+    for i, order in enumerate(orders):
+        for p in order:
+            if costs[i][p] <= min(share - used[i], remaining):
+                selected[i].add(p)
+                used[i] += costs[i][p]
+                remaining -= costs[i][p]
+        if order and not selected[i] and min(share, remaining) > 0:
+            # Keep at least the truncated best passage of every chunk
+            best = order[0]
+            cleaned[i][best] = truncate_to_tokens(cleaned[i][best], min(share, remaining))
+            costs[i][best] = count_tokens(cleaned[i][best])
+            selected[i].add(best)
+            used[i] += costs[i][best]
+            remaining -= costs[i][best]
+    for i, order in enumerate(orders):
+        for p in order:
+            if p not in selected[i] and costs[i][p] <= remaining:
+                selected[i].add(p)
+                used[i] += costs[i][p]
+                remaining -= costs[i][p]
+
+    if not any(selected):
+        fallback = next((i for i, order in enumerate(orders) if order), None)
+        if fallback is not None:
+            logging.warning(f"Context budget of {budget} tokens fits no passage of {len(top_chunks)} chunks; keeping {MIN_CONTEXT_TOKENS} tokens of the top chunk")
+            best = orders[fallback][0]
+            cleaned[fallback][best] = truncate_to_tokens(cleaned[fallback][best], MIN_CONTEXT_TOKENS)
+            selected[fallback].add(best)
+
+    blocks = {}
+    for i, chunk in enumerate(top_chunks):
+        if not selected[i]:
+            continue
+        topic, post_number = topic_key(chunk)
+        body = "\n".join(cleaned[i][p] for p in sorted(selected[i]))
+        key = topic if topic is not None else f"chunk-{i}"
+        blocks.setdefault(key, []).append((post_number, f"Post URL: {base_url}{chunk['post_url']}\nContent:\n{body}"))
+
+    context = "\n\n".join(
+        "\n\n".join(text for _, text in sorted(posts, key=lambda post: post[0]))
+        for posts in blocks.values()
+    )
+    return context, count_tokens(context)
@@ -0,0 +1,213 @@
+import re
+import json
+import zlib
+import hashlib
+import argparse
+import numpy as np
+from context import QUOTE_PATTERN, TAG_PATTERN, TOPIC_URL_PATTERN
+from columns import AUTHOR_PATTERN
+
+# "near" merges exact and near duplicates, "exact" only identical bodies, "off" nothing
+DEDUP_MODES = ("near", "exact", "off")
+# Estimated Jaccard similarity at or above which two chunks are near duplicates
+DEDUP_THRESHOLD = 0.9
+# MinHash permutations, split into LSH_BANDS bands of NUM_PERM // LSH_BANDS rows;
+# 16 bands of 8 rows make pairs above ~0.7 similarity likely to share a bucket
+NUM_PERM = 128
+LSH_BANDS = 16
+SHINGLE_WORDS = 5
+# Bodies shorter than this many words ("read this", "same problem") are only
+# collapsed with copies of the same post
+MIN_DUPLICATE_WORDS = 20
+
+METADATA_LINE_PATTERN = re.compile(r"^(### Post \d+|## Topic: .*|\*\*[A-Za-z ]+\*\*: .*|- \*\*[A-Za-z ]+\*\*:.*)$")
+# Mersenne prime for the universal hash family of the MinHash permutations
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+
+def normalize_body(text):
+    """Return a chunk's comparable body: no metadata lines, quotes or tags, casefolded and whitespace-collapsed."""
+    text = QUOTE_PATTERN.sub(" ", text)
+    lines = [line for line in text.split("\n") if not METADATA_LINE_PATTERN.match(line.strip())]
+    return " ".join(TAG_PATTERN.sub(" ", "\n".join(lines)).casefold().split())
+
+def shingle_hashes(words):
+    """Return the CRC32 hashes of a body's SHINGLE_WORDS-word shingles as a uint64 array."""
+    count = max(len(words) - SHINGLE_WORDS + 1, 1)
+    shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(count)}
+    return np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+
+def minhash_signatures(shingle_sets, num_perm=NUM_PERM, seed=1):
+    """Return a (len(shingle_sets), num_perm) uint64 MinHash signature matrix.
+
+    Permutations are (a * x + b) mod 2^61 - 1 with fixed seeded a and b, so
+    signatures are reproducible across builds. a stays below 2^31 so the
+    products of 32-bit shingle hashes cannot overflow uint64.
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 31, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, 1 << 31, size=num_perm, dtype=np.uint64)
+    signatures = np.empty((len(shingle_sets), num_perm), dtype=np.uint64)
+    for i, hashes in enumerate(shingle_sets):
+        signatures[i] = ((np.outer(hashes, a) + b) % MERSENNE_PRIME).min(axis=0)
+    return signatures
+
+def lsh_candidate_pairs(signatures, bands=LSH_BANDS):
+    """Return the set of (i, j) row pairs that share an LSH bucket in any band."""
+    rows = signatures.shape[1] // bands
+    pairs = set()
+    for band in range(bands):
+        buckets = {}
+        for i, key in enumerate(map(bytes, signatures[:, band * rows:(band + 1) * rows])):
+            buckets.setdefault(key, []).append(i)
+        for members in buckets.values():
+            for x, i in enumerate(members):
+                for j in members[x + 1:]:
+                    pairs.add((i, j))
+    return pairs
+
+def find(parents, i):
+    while parents[i] != i:
+        parents[i] = parents[parents[i]]
+        i = parents[i]
+    return i
+
+def merge_scope(text, entry):
+    """Return the scope a chunk may be merged within: its (topic id, author), or its own URL off the forum.
+
+    Posts in different topics or by different authors carry different facts
+    and metadata columns (e.g. templated assignment threads with their own
+    deadlines), so they are never collapsed into each other.
+    """
+    topic = TOPIC_URL_PATTERN.match(entry.get("post_url") or "")
+    if not topic:
+        return entry.get("post_url")
+    author = AUTHOR_PATTERN.search(text)
+    return topic.group(1), author.group(1).lower() if author else None
+
+def duplicate_groups(texts, metadata, threshold=DEDUP_THRESHOLD):
+    """Group chunk rows that are exact or near duplicates of each other.
+
+    Chunks are compared on their normalized body and only merged within
+    their merge_scope. Identical bodies are found by SHA-256; bodies under
+    MIN_DUPLICATE_WORDS words only match copies of the same post URL. Near
+    duplicates share an LSH bucket of their MinHash signatures over word
+    shingles, and are confirmed when the estimated Jaccard similarity
+    reaches `threshold` (None skips this step). The canonical row of a
+    group has the longest body (the earliest on ties). Returns (groups,
+    exact, near): the groups of two or more rows, each with its canonical
+    row first and the rest in row order, and the number of rows merged by
+    hash and by MinHash. Chunks with an empty body are never merged.
+    """
+    bodies = [normalize_body(text) for text in texts]
+    scopes = [merge_scope(text, entry) for text, entry in zip(texts, metadata)]
+    long_enough = [len(body.split()) >= MIN_DUPLICATE_WORDS for body in bodies]
+    parents = list(range(len(texts)))
+    exact = near = 0
+
+    first_by_hash = {}
+    for i, body in enumerate(bodies):
+        if not body:
+            continue
+        scope = scopes[i] if long_enough[i] else metadata[i]["post_url"]
+        key = (json.dumps(scope), hashlib.sha256(body.encode("utf-8")).digest())
+        if key in first_by_hash:
+            parents[i] = first_by_hash[key]
+            exact += 1
+        else:
+            first_by_hash[key] = i
+
+    if threshold is not None:
+        rows = [i for i in first_by_hash.values() if long_enough[i]]
+        signatures = minhash_signatures([shingle_hashes(bodies[i].split()) for i in rows])
+        for x, y in sorted(lsh_candidate_pairs(signatures)):
+            if scopes[rows[x]] != scopes[rows[y]]:
+                continue
+            if np.count_nonzero(signatures[x] == signatures[y]) / NUM_PERM < threshold:
+                continue
+            root_x, root_y = find(parents, rows[x]), find(parents, rows[y])
+            if root_x != root_y:
+                parents[max(root_x, root_y)] = min(root_x, root_y)
+                near += 1
+
+    members = {}
+    for i in range(len(texts)):
+        members.setdefault(find(parents, i), []).append(i)
+    groups = []
+    for group in members.values():
+        if len(group) > 1:
+            canonical = max(group, key=lambda i: (len(bodies[i]), -i))
+            groups.append([canonical] + [i for i in group if i != canonical])
+    return groups, exact, near
+
+def deduplicate(texts, metadata, mode="near", threshold=DEDUP_THRESHOLD):
+    """Collapse duplicate chunks into their canonical chunk, keeping row order.
+
+    The canonical chunk's metadata gains "source_urls", the post URLs of
+    every chunk in its group with its own first. `mode` is one of
+    DEDUP_MODES. Returns (texts, metadata, report) where report records the
+    options, the input and output chunk counts and the exact and near
+    duplicates removed.
+    """
+    if mode not in DEDUP_MODES:
+        raise ValueError(f"Unknown dedup mode {mode!r}; expected one of {DEDUP_MODES}")
+    if mode == "off":
+        return texts, metadata, {"mode": mode, "input": len(texts), "output": len(texts)}
+    groups, exact, near = duplicate_groups(texts, metadata, threshold if mode == "near" else None)
+    removed = set()
+    sources = {}
+    for group in groups:
+        removed.update(group[1:])
+        urls = [metadata[i]["post_url"] for i in group]
+        sources[group[0]] = list(dict.fromkeys(urls))
+    kept_texts, kept_metadata = [], []
+    for i, (text, entry) in enumerate(zip(texts, metadata)):
+        if i in removed:
+            continue
+        if len(sources.get(i, ())) > 1:
+            entry = {**entry, "source_urls": sources[i]}
+        kept_texts.append(text)
+        kept_metadata.append(entry)
+    report = {
+        "mode": mode,
+        "threshold": threshold if mode == "near" else None,
+        "input": len(texts),
+        "output": len(kept_texts),
+        "exact": exact,
+        "near": near,
+        "groups": len(groups),
+        "sources_sha256": hashlib.sha256(json.dumps(sorted(sources.values())).encode("utf-8")).hexdigest(),
+    }
+    return kept_texts, kept_metadata, report
+
+def format_report(report):
+    if report["mode"] == "off":
+        return f"Deduplication off: {report['input']} chunks"
+    removed = report["input"] - report["output"]
+    share = removed / report["input"] if report["input"] else 0.0
+    return (f"Deduplicated {report['input']} chunks to {report['output']}: removed {removed} ({share:.1%}), "
+            f"{report['exact']} exact and {report['near']} near duplicates in {report['groups']} groups")
+
+def dedup_writer(report):
+    """Return a write_store writer that records the deduplication report in the header."""
+    def write(version_dir, embeddings):
+        return {"dedup": report}
+    return write
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report exact and near-duplicate chunks without building the store.")
+    parser.add_argument("--mode", choices=["near", "exact"], default="near", help="Merge near duplicates too, or only identical bodies")
+    parser.add_argument("--threshold", type=float, default=DEDUP_THRESHOLD, help="Estimated Jaccard similarity of near duplicates")
+    parser.add_argument("--show", type=int, default=10, help="Largest duplicate groups to list")
+    args = parser.parse_args(argv)
+
+    from vercel_npzfile import read_chunks
+
+    texts, metadata = read_chunks()
+    _, kept_metadata, report = deduplicate(texts, metadata, args.mode, args.threshold)
+    print(format_report(report))
+    groups = [entry["source_urls"] for entry in kept_metadata if "source_urls" in entry]
+    for urls in sorted(groups, key=len, reverse=True)[:args.show]:
+        print(f"{len(urls)} sources: " + ", ".join(urls))
+
+if __name__ == "__main__":
+    main()
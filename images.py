@@ -0,0 +1,113 @@
+import io
+import os
+import base64
+import hashlib
+import logging
+import binascii
+from caches import LRUCache
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # Without Pillow images are validated and forwarded as sent
+    Image = None
+    logging.warning("Pillow is not installed; query images will not be downscaled or recompressed")
+
+# Largest decoded image accepted, and the matching cap on the base64 request field
+MAX_IMAGE_BYTES = int(os.environ.get("MAX_IMAGE_BYTES", str(8 * 1024 * 1024)))
+MAX_IMAGE_BASE64_LENGTH = 4 * -(-MAX_IMAGE_BYTES // 3) + 64  # + room for a data URL prefix
+# Images are downscaled so their longer side fits IMAGE_MAX_SIDE pixels and
+# recompressed at IMAGE_QUALITY; smaller images are kept unless recompression shrinks them
+IMAGE_MAX_SIDE = int(os.environ.get("IMAGE_MAX_SIDE", "1536"))
+IMAGE_QUALITY = int(os.environ.get("IMAGE_QUALITY", "80"))
+IMAGE_CACHE_SIZE = int(os.environ.get("IMAGE_CACHE_SIZE", "256"))
+
+# Leading bytes of the formats the vision model accepts
+SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+class ImageError(ValueError):
+    """An image payload that is malformed, too large or not in a supported format."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+def detect_format(data):
+    """Return the MIME type of PNG, JPEG, GIF or WebP bytes from their signature, or None."""
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, mime in SIGNATURES:
+        if data.startswith(signature):
+            return mime
+    return None
+
+def decode_image(payload):
+    """Decode a base64 image or data URL, enforcing MAX_IMAGE_BYTES before decoding."""
+    if payload.startswith("data:"):
+        _, _, payload = payload.partition(",")
+    payload = "".join(payload.split())
+    if len(payload) > MAX_IMAGE_BASE64_LENGTH:
+        raise ImageError(f"Image is larger than {MAX_IMAGE_BYTES} bytes", status_code=413)
+    try:
+        data = base64.b64decode(payload, validate=True)
+    except (binascii.Error, ValueError):
+        raise ImageError("Image is not valid base64")
+    if len(data) > MAX_IMAGE_BYTES:
+        raise ImageError(f"Image is larger than {MAX_IMAGE_BYTES} bytes", status_code=413)
+    return data
+
+def recompress(data, mime):
+    """Downscale and re-encode image bytes with Pillow; returns (data, mime), the original when that is smaller."""
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        original_size = image.size
+        image.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE), Image.LANCZOS)
+        resized = image.size != original_size
+        buffer = io.BytesIO()
+        if features.check("webp"):
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB")
+            image.save(buffer, format="WEBP", quality=IMAGE_QUALITY, method=4)
+            encoded_mime = "image/webp"
+        else:
+            image.convert("RGB").save(buffer, format="JPEG", quality=IMAGE_QUALITY, optimize=True)
+            encoded_mime = "image/jpeg"
+    encoded = buffer.getvalue()
+    if not resized and len(encoded) >= len(data):
+        return data, mime
+    logging.info(f"Recompressed {mime} image {original_size[0]}x{original_size[1]} ({len(data)} bytes) to {image.size[0]}x{image.size[1]} {encoded_mime} ({len(encoded)} bytes)")
+    return encoded, encoded_mime
+
+class ImageProcessor:
+    """Validate, downscale and recompress query images, caching results by content hash.
+
+    `prepare` returns ({"digest", "url"}, cached) where url is the data URL
+    to send to the model. Repeated screenshots are served from the cache
+    instead of being re-encoded, and the digest lets callers key answer
+    caches on the image.
+    """
+
+    def __init__(self, max_entries=IMAGE_CACHE_SIZE):
+        self.cache = LRUCache(max_entries)
+
+    def prepare(self, payload):
+        data = decode_image(payload)
+        digest = hashlib.sha256(data).hexdigest()
+        cached = self.cache.get(digest)
+        if cached is not None:
+            return cached, True
+        mime = detect_format(data)
+        if mime is None:
+            raise ImageError("Unsupported image format; send PNG, JPEG, GIF or WebP")
+        if Image is not None and mime != "image/gif":  # GIFs may be animated; forwarded as sent
+            try:
+                data, mime = recompress(data, mime)
+            except (OSError, ValueError, Image.DecompressionBombError) as e:
+                raise ImageError(f"Image could not be decoded: {e}")
+        image = {"digest": digest, "url": f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"}
+        self.cache.put(digest, image)
+        return image, False
@@ -0,0 +1,110 @@
+import os
+import re
+import json
+import logging
+from collections import Counter
+import numpy as np
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+VOCAB_FILE = "bm25_vocab.json"
+OFFSETS_FILE = "bm25_offsets.npy"
+DOC_IDS_FILE = "bm25_doc_ids.npy"
+WEIGHTS_FILE = "bm25_weights.npy"
+
+TAG_PATTERN = re.compile(r"<[^>]+>")
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[._\-][a-z0-9]+)*")
+
+def tokenize(text):
+    """Lowercase word tokens with HTML tags removed.
+
+    Dotted, dashed and underscored runs such as "gpt-4o-mini", "ga5.q7" or
+    "tds_project" stay single tokens so exact identifiers match exactly.
+    """
+    return TOKEN_PATTERN.findall(TAG_PATTERN.sub(" ", text).lower())
+
+class BM25Index:
+    """BM25 inverted index stored as compact postings arrays.
+
+    Postings are in CSR layout: the postings of term t are
+    doc_ids[offsets[t]:offsets[t + 1]] with the matching precomputed BM25
+    weights (idf times the saturated, length-normalized term frequency), so a
+    query only adds weight slices into a score vector. The arrays are loaded
+    with mmap_mode="r" and shared through the page cache.
+    """
+
+    def __init__(self, vocabulary, offsets, doc_ids, weights, count):
+        self.vocabulary = vocabulary
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.count = count
+
+    @classmethod
+    def open(cls, version_dir, count):
+        with open(os.path.join(version_dir, VOCAB_FILE), "r", encoding="utf-8") as f:
+            terms = json.load(f)
+        vocabulary = {term: i for i, term in enumerate(terms)}
+        offsets = np.load(os.path.join(version_dir, OFFSETS_FILE), mmap_mode="r")
+        doc_ids = np.load(os.path.join(version_dir, DOC_IDS_FILE), mmap_mode="r")
+        weights = np.load(os.path.join(version_dir, WEIGHTS_FILE), mmap_mode="r")
+        if len(offsets) != len(terms) + 1 or len(doc_ids) != len(weights):
+            raise ValueError(f"Invalid BM25 index in {version_dir}")
+        return cls(vocabulary, offsets, doc_ids, weights, count)
+
+    def scores(self, query):
+        """Return the BM25 score of every chunk for a query string."""
+        scores = np.zeros(self.count, dtype=np.float32)
+        for term, repeats in Counter(tokenize(query)).items():
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = int(self.offsets[term_id]), int(self.offsets[term_id + 1])
+            # Each chunk appears at most once per term, so plain fancy-index addition is safe
+            scores[self.doc_ids[start:end]] += repeats * self.weights[start:end]
+        return scores
+
+def build_bm25(texts, k1=BM25_K1, b=BM25_B):
+    """Build (terms, offsets, doc_ids, weights) postings arrays for a list of chunk texts."""
+    doc_terms = [Counter(tokenize(text)) for text in texts]
+    doc_lengths = np.array([sum(terms.values()) for terms in doc_terms], dtype=np.float32)
+    average_length = float(doc_lengths.mean()) if len(texts) and doc_lengths.mean() > 0 else 1.0
+
+    postings = {}
+    for doc_id, terms in enumerate(doc_terms):
+        for term, frequency in terms.items():
+            postings.setdefault(term, []).append((doc_id, frequency))
+
+    terms = sorted(postings)
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    doc_ids = np.empty(sum(len(postings[term]) for term in terms), dtype=np.int32)
+    weights = np.empty(len(doc_ids), dtype=np.float32)
+    position = 0
+    for term_id, term in enumerate(terms):
+        entries = postings[term]
+        ids = np.array([doc_id for doc_id, _ in entries], dtype=np.int32)
+        frequencies = np.array([frequency for _, frequency in entries], dtype=np.float32)
+        idf = np.log(1.0 + (len(texts) - len(entries) + 0.5) / (len(entries) + 0.5))
+        norm = k1 * (1.0 - b + b * doc_lengths[ids] / average_length)
+        doc_ids[position:position + len(entries)] = ids
+        weights[position:position + len(entries)] = idf * frequencies * (k1 + 1.0) / (frequencies + norm)
+        position += len(entries)
+        offsets[term_id + 1] = position
+    return terms, offsets, doc_ids, weights
+
+def bm25_writer(texts):
+    """Return a write_store writer that stores a BM25 index over the chunk texts."""
+    def write(version_dir, embeddings):
+        if len(texts) != len(embeddings):
+            raise ValueError(f"Expected one text per embedding row, got {len(texts)} for {len(embeddings)}")
+        terms, offsets, doc_ids, weights = build_bm25(texts)
+        with open(os.path.join(version_dir, VOCAB_FILE), "w", encoding="utf-8") as f:
+            json.dump(terms, f, ensure_ascii=False, separators=(",", ":"))
+        np.save(os.path.join(version_dir, OFFSETS_FILE), offsets)
+        np.save(os.path.join(version_dir, DOC_IDS_FILE), doc_ids)
+        np.save(os.path.join(version_dir, WEIGHTS_FILE), weights)
+        logging.info(f"Built BM25 index: {len(terms)} terms, {len(doc_ids)} postings")
+        return {"bm25": {"k1": BM25_K1, "b": BM25_B}}
+    return write
@@ -1,15 +1,34 @@
-from fastapi import FastAPI, HTTPException
-from openai import OpenAI
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
+from openai import AsyncOpenAI
+from pydantic import BaseModel, Field, field_validator
 import numpy as np
 import json
 import os
+import time
+import asyncio
+import httpx
 import logging
-import re
-import base64
-from typing import Optional
+from typing import List, Optional
+from datetime import datetime, timezone
+from functools import lru_cache
 from fastapi.middleware.cors import CORSMiddleware
+from vector_store import ResidentStore
+from retrieval import SCORING_MODE, attach_backend, search, search_batch
+from chunk_format import extract_content_preview
+from chunking import read_chunk_text
+from context import build_context
+from caches import EmbeddingCache, SemanticAnswerCache, RequestCoalescer, normalize_question
+from images import ImageProcessor, ImageError, MAX_IMAGE_BASE64_LENGTH
+import metrics
+from metrics import stage
 # Set up logging
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"), format="%(asctime)s - %(levelname)s - %(message)s")
+# Send an X-Timing header with the per-stage breakdown on every response; clients
+# can also ask for it on a single request by sending an X-Timing request header
+EXPOSE_TIMING = os.environ.get("EXPOSE_TIMING", "0") not in ("0", "false", "False")
+
 app = FastAPI()
 
 app.add_middleware(
@@ -18,174 +37,593 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Timing"],
 )
-# Initialize Open AI client with proxy base URL
+
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    """Record request latency and status, and attach the X-Timing breakdown when asked for."""
+    timings = metrics.start_request_timing()
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+    # Label by route template so unknown URLs cannot grow the series without bound
+    route = request.scope.get("route")
+    path = route.path if route is not None else "unmatched"
+    metrics.request_seconds.observe(elapsed, path)
+    metrics.requests_total.inc(path, response.status_code)
+    if EXPOSE_TIMING or "x-timing" in request.headers:
+        response.headers["X-Timing"] = metrics.format_timings(timings, elapsed)
+    return response
+# Upstream limits: pooled connections, per-call timeouts (seconds) and the
+# number of embedding/LLM calls a worker keeps in flight at once
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", "64"))
+OPENAI_MAX_CONCURRENCY = int(os.environ.get("OPENAI_MAX_CONCURRENCY", "32"))
+EMBED_TIMEOUT = float(os.environ.get("EMBED_TIMEOUT", "15"))
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "60"))
+
+# Initialize async Open AI client with proxy base URL over a shared connection pool
 openai_api_key = os.environ.get("OPEN_API_KEY")
-client = OpenAI(
+http_client = httpx.AsyncClient(
+    limits=httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+        keepalive_expiry=60,
+    ),
+    timeout=httpx.Timeout(LLM_TIMEOUT, connect=5.0),
+)
+client = AsyncOpenAI(
     api_key=openai_api_key,
-    base_url="https://aiproxy.sanand.workers.dev/openai/v1"
+    base_url=os.environ.get("OPENAI_BASE_URL", "https://aiproxy.sanand.workers.dev/openai/v1"),
+    http_client=http_client,
+)
+upstream_slots = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+
+# Query embedding model and its cache (EMBED_CACHE_PATH enables the on-disk tier)
+EMBED_MODEL = "text-embedding-3-small"
+EMBED_DIMENSIONS = 768
+embedding_cache = EmbeddingCache(
+    EMBED_MODEL,
+    EMBED_DIMENSIONS,
+    max_entries=int(os.environ.get("EMBED_CACHE_SIZE", "2048")),
+    disk_path=os.environ.get("EMBED_CACHE_PATH") or None,
+    disk_max_entries=int(os.environ.get("EMBED_CACHE_DISK_SIZE", "100000")),
 )
 
+# Answers reused for questions within ANSWER_CACHE_THRESHOLD cosine of a cached
+# one that retrieved the same chunks; identical concurrent questions share one LLM call
+answer_cache = SemanticAnswerCache(
+    threshold=float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.95")),
+    ttl=float(os.environ.get("ANSWER_CACHE_TTL", "600")),
+    max_entries=int(os.environ.get("ANSWER_CACHE_SIZE", "1024")),
+)
+llm_coalescer = RequestCoalescer()
+# Query images after validation, downscaling and recompression, keyed by content hash
+image_processor = ImageProcessor()
+
+LLM_MODEL = "gpt-4o-mini"
+# Upper bound on prompt tokens spent on retrieved context
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "3000"))
+NO_CHUNKS_ANSWER = "No relevant chunks found to answer the query."
+# Period of the forum posts named in the system prompt when a query sets no date filter
+FORUM_DATE_RANGE = os.environ.get("FORUM_DATE_RANGE", "January 1 to April 15, 2025")
+# Questions accepted by one /query/batch request, the chunks it may ask for per
+# question, and its LLM calls in flight
+MAX_BATCH_QUESTIONS = int(os.environ.get("MAX_BATCH_QUESTIONS", "256"))
+MAX_BATCH_K = int(os.environ.get("MAX_BATCH_K", "50"))
+BATCH_LLM_CONCURRENCY = int(os.environ.get("BATCH_LLM_CONCURRENCY", "8"))
+
 # Paths and constants
 chunks_dir = "chunks"
 npz_path = "vector_store.npz"
+store_dir = "vector_store"
 BASE_URL = "https://discourse.onlinedegree.iitm.ac.in"
+# Chunk files kept in memory when the store has no packed content file
+CHUNK_CACHE_SIZE = int(os.environ.get("CHUNK_CACHE_SIZE", "256"))
+
+# Prefer the memory-mapped store directory; fall back to the legacy compressed npz
+store_path = os.environ.get("VECTOR_STORE_PATH") or (store_dir if os.path.isdir(store_dir) else npz_path)
+
+def on_store_load(snapshot):
+    """Prepare a freshly loaded store snapshot before it starts serving requests."""
+    attach_backend(snapshot)
+    read_chunk_file.cache_clear()
+    answer_cache.clear()
+
+# Loaded once per process and hot-reloaded when the store changes on disk
+resident_store = ResidentStore(
+    store_path,
+    quantize=None if SCORING_MODE == "exact" else SCORING_MODE,
+    on_load=on_store_load,
+)
+
+class QueryFilters(BaseModel):
+    created_after: Optional[datetime] = None
+    created_before: Optional[datetime] = None  # Inclusive; a date alone means the end of that day
+    topic_ids: Optional[List[int]] = None
+    authors: Optional[List[str]] = None  # Forum usernames
+    source: Optional[List[str]] = None  # "forum" and/or "course"
+
+    @field_validator("created_before", mode="before")
+    @classmethod
+    def end_of_day(cls, value):
+        # "2025-04-14" would otherwise parse as midnight and exclude that day's posts
+        if isinstance(value, str) and len(value) == 10:
+            return f"{value}T23:59:59"
+        return value
 
 class QueryRequest(BaseModel):
     question: str
-    image: Optional[str] = None  # Optional base64-encoded image
+    image: Optional[str] = Field(None, max_length=MAX_IMAGE_BASE64_LENGTH)  # Optional base64-encoded image or data URL
+    filters: Optional[QueryFilters] = None
 
-def embed_text(text):
-    """Generate embedding using Open AI via proxy."""
+class BatchQueryRequest(BaseModel):
+    questions: List[str]
+    k: int = Field(5, ge=1, le=MAX_BATCH_K)
+    retrieval_only: bool = False  # Return the retrieved chunks without calling the LLM
+    filters: Optional[QueryFilters] = None  # Applied to every question
+
+async def embed_text(text):
+    """Generate embedding using Open AI via proxy, reusing cached embeddings of repeated questions."""
     try:
-        response = client.embeddings.create(
-            model="text-embedding-3-small",
-            dimensions=768,
-            input=text
-        )
+        embedding = await run_in_threadpool(embedding_cache.get, text)
+        metrics.cache_events.inc("embedding", "miss" if embedding is None else "hit")
+        if embedding is not None:
+            logging.info(f"Embedding cache hit (length: {len(text)})")
+            return embedding
+        async with upstream_slots:
+            with stage("embed"):
+                response = await client.embeddings.create(
+                    model=EMBED_MODEL,
+                    dimensions=EMBED_DIMENSIONS,
+                    input=text,
+                    timeout=EMBED_TIMEOUT
+                )
         embedding = np.array(response.data[0].embedding, dtype=np.float32)
+        await run_in_threadpool(embedding_cache.put, text, embedding)
         logging.info(f"Embedded query (length: {len(text)})")
         return embedding
     except Exception as e:
         logging.error(f"Error embedding query: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error embedding query: {str(e)}")
 
+async def embed_texts(texts):
+    """Embed many questions with one embeddings call for those not already cached; returns a matrix."""
+    try:
+        embeddings = await run_in_threadpool(embedding_cache.get_many, texts)
+        missing = sorted({text for text, embedding in zip(texts, embeddings) if embedding is None})
+        metrics.cache_events.inc("embedding", "hit", amount=len(texts) - sum(embedding is None for embedding in embeddings))
+        metrics.cache_events.inc("embedding", "miss", amount=sum(embedding is None for embedding in embeddings))
+        if missing:
+            async with upstream_slots:
+                with stage("embed"):
+                    response = await client.embeddings.create(
+                        model=EMBED_MODEL,
+                        dimensions=EMBED_DIMENSIONS,
+                        input=missing,
+                        timeout=EMBED_TIMEOUT
+                    )
+            fresh = {}
+            for item in response.data:
+                fresh[missing[item.index]] = np.array(item.embedding, dtype=np.float32)
+            await run_in_threadpool(embedding_cache.put_many, fresh.items())
+            embeddings = [fresh[text] if embedding is None else embedding for text, embedding in zip(texts, embeddings)]
+        logging.info(f"Embedded {len(texts)} queries ({len(missing)} uncached) in one call")
+        return np.stack(embeddings)
+    except Exception as e:
+        logging.error(f"Error embedding queries: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error embedding queries: {str(e)}")
+
 def load_vector_store():
-    """Load embeddings and metadata from vector_store.npz safely."""
-    if not os.path.exists(npz_path):
-        raise HTTPException(status_code=500, detail="vector_store.npz not found on server.")
+    """Return the resident vector store snapshot, reloading it if the file changed."""
+    try:
+        with stage("store_load"):
+            return resident_store.get()
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    except Exception as e:
+        logging.error(f"Failed to load vector store: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to load vector store: {str(e)}")
+
+@lru_cache(maxsize=CHUNK_CACHE_SIZE)
+def read_chunk_file(file_name, shard=None, offset=0, length=0):
+    """Read a chunk and its preview from its shard or file; only used for stores without a content pack."""
+    content = read_chunk_text(chunks_dir, {"file": file_name, "shard": shard, "offset": offset, "length": length})
+    return content, extract_content_preview(content)
+
+def read_chunk(store, idx):
+    """Return (content, preview) for a chunk, sliced from the store's content pack when present."""
+    if store.content is not None:
+        content = store.content.get(idx)
+        preview = store.metadata[idx].get("preview")
+        return content, preview if preview is not None else extract_content_preview(content)
+    entry = store.metadata[idx]
+    return read_chunk_file(entry["file"], entry.get("shard"), entry.get("offset", 0), entry.get("length", 0))
 
+async def embed_query(query):
+    """Embed a question and normalize it to unit length."""
+    query_embedding = await embed_text(query)
+    return query_embedding / np.linalg.norm(query_embedding)
+
+async def prepare_image(payload: Optional[str]):
+    """Validate, downscale and recompress a request image; returns {"digest", "url"} or None."""
+    if not payload:
+        return None
     try:
-        with np.load(npz_path, allow_pickle=True) as data:
-            if "embeddings" not in data or "metadata" not in data:
-                raise HTTPException(status_code=500, detail="Invalid vector_store.npz: missing keys.")
+        with stage("image"):
+            image, cached = await run_in_threadpool(image_processor.prepare, payload)
+    except ImageError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    metrics.cache_events.inc("image", "hit" if cached else "miss")
+    return image
 
-            embeddings = data["embeddings"]
-            metadata = data["metadata"]
+def answer_cache_key(top_chunks, image=None):
+    """Chunk ids an answer is cached under, plus the image's content hash when there is one."""
+    chunk_ids = tuple(chunk["file"] for chunk in top_chunks)
+    return chunk_ids + (f"image:{image['digest']}",) if image else chunk_ids
 
-            if isinstance(metadata, np.ndarray):
-                metadata = metadata.item() if metadata.size == 1 else metadata[0]
+def unix_time(value):
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
 
-            chunk_metadata = json.loads(metadata)
-            logging.info(f"Loaded {len(chunk_metadata)} metadata entries and embeddings.")
-            return embeddings, chunk_metadata
+def filter_mask(store, filters: Optional[QueryFilters]):
+    """Return the boolean row mask of a query's filters, or None when it has none."""
+    if filters is None or not any(value is not None for value in filters.model_dump().values()):
+        return None
+    if store.columns is None:
+        raise HTTPException(status_code=400, detail="The vector store has no metadata columns; rebuild it to use filters")
+    return store.columns.mask(
+        created_after=unix_time(filters.created_after),
+        created_before=unix_time(filters.created_before),
+        topic_ids=filters.topic_ids,
+        authors=filters.authors,
+        sources=filters.source,
+    )
 
-    except Exception as e:
-        logging.error(f"Failed to load vector store: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to load vector store: {str(e)}")
+def describe_date_range(filters: Optional[QueryFilters]):
+    """Return the period of posts to name in the system prompt, or None for FORUM_DATE_RANGE."""
+    if filters is None or (filters.created_after is None and filters.created_before is None):
+        return None
+    if filters.created_before is None:
+        return f"{format_prompt_date(filters.created_after)} onwards"
+    if filters.created_after is None:
+        return f"up to {format_prompt_date(filters.created_before)}"
+    return f"{format_prompt_date(filters.created_after)} to {format_prompt_date(filters.created_before)}"
+
+def format_prompt_date(value):
+    return f"{value:%B} {value.day}, {value.year}"
+
+def collect_chunks(store, indices, scores):
+    """Return result dicts for the chunks at `indices`, skipping invalid or unreadable ones."""
+    metadata = store.metadata
+    results = []
+    for idx, score in zip(indices, scores):
+        if idx >= len(metadata):
+            logging.warning(f"Invalid index {idx} for metadata length {len(metadata)}")
+            continue
+        try:
+            content, preview = read_chunk(store, idx)
+            results.append({
+                "content": content,
+                "post_url": metadata[idx]["post_url"],
+                # Every post a deduplicated chunk was collapsed from, its own first
+                "source_urls": metadata[idx].get("source_urls") or [metadata[idx]["post_url"]],
+                "file": metadata[idx]["file"],
+                "preview": preview,
+                "score": float(score)
+            })
+        except Exception as e:
+            logging.error(f"Error reading chunk {metadata[idx]['file']}: {str(e)}")
+            continue
+    return results
 
-def extract_content_preview(content):
-    """Extract concise content preview after metadata."""
+async def retrieve_top_chunks(query, store, k=5, norm_query=None, mask=None):
+    """Retrieve top-k chunks using cosine similarity against the resident store, among rows passing `mask`."""
     try:
-        lines = content.split("\n")
-        content_start = 0
-        for i, line in enumerate(lines):
-            if line.startswith("- **Content**:"):
-                content_start = i + 1
-                break
-        preview = " ".join(lines[content_start:]).strip()[:200]
-        preview = re.sub(r'<[^>]+>', '', preview)  # Remove HTML tags
-        return preview + "..." if len(preview) == 200 else preview
+        if norm_query is None:
+            norm_query = await embed_query(query)
+        # Scoring is CPU-bound; keep it off the event loop
+        with stage("score"):
+            top_k_indices, top_k_scores = await run_in_threadpool(search, store, norm_query, k, query, mask=mask)
+        with stage("chunk_read"):
+            results = collect_chunks(store, top_k_indices, top_k_scores)
+        logging.info(f"Retrieved {len(results)} chunks for query: {query}")
+        return results
     except Exception as e:
-        logging.error(f"Error extracting preview: {str(e)}")
-        return content[:200] + "..."
+        logging.error(f"Error retrieving chunks: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error retrieving chunks: {str(e)}")
 
-def retrieve_top_chunks(query, embeddings, metadata, k=5):
-    """Retrieve top-k chunks using cosine similarity."""
+async def retrieve_top_chunks_batch(queries, store, norm_queries, k=5, mask=None):
+    """Retrieve top-k chunks for many queries with one matrix-matrix scoring pass; one list per query."""
     try:
-        query_embedding = embed_text(query)
-        norm_query = query_embedding / np.linalg.norm(query_embedding)
-        norm_embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
-        similarities = np.dot(norm_embeddings, norm_query)
-        top_k_indices = np.argsort(similarities)[::-1][:k]
-        results = []
-        for idx in top_k_indices:
-            if idx >= len(metadata):
-                logging.warning(f"Invalid index {idx} for metadata length {len(metadata)}")
-                continue
-            try:
-                with open(os.path.join(chunks_dir, metadata[idx]["file"]), "r", encoding="utf-8") as f:
-                    content = f.read()
-                preview = extract_content_preview(content)
-                results.append({
-                    "content": content,
-                    "post_url": metadata[idx]["post_url"],
-                    "file": metadata[idx]["file"],
-                    "preview": preview,
-                    "score": float(similarities[idx])
-                })
-            except Exception as e:
-                logging.error(f"Error reading chunk {metadata[idx]['file']}: {str(e)}")
-                continue
-        logging.info(f"Retrieved {len(results)} chunks for query: {query}")
+        with stage("score"):
+            rankings = await run_in_threadpool(search_batch, store, norm_queries, k, queries, mask=mask)
+        with stage("chunk_read"):
+            results = [collect_chunks(store, indices, scores) for indices, scores in rankings]
+        logging.info(f"Retrieved chunks for {len(queries)} queries in one batch")
         return results
     except Exception as e:
         logging.error(f"Error retrieving chunks: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error retrieving chunks: {str(e)}")
 
-def query_llm(query, top_chunks, image_base64: Optional[str] = None):
+def build_messages(query, top_chunks, image: Optional[dict] = None, date_range: Optional[str] = None):
+    """Build the chat messages for a query, its top chunks and an optional prepared image.
+
+    `date_range` names the period of the posts in the system prompt (default
+    FORUM_DATE_RANGE). Returns (messages, context_tokens); the context is
+    trimmed to CONTEXT_TOKEN_BUDGET.
+    """
+    with stage("context_build"):
+        context, context_tokens = build_context(query, top_chunks, BASE_URL, CONTEXT_TOKEN_BUDGET)
+    metrics.tokens_total.inc("context", amount=context_tokens)
+    logging.info(f"Built context of {context_tokens} tokens from {len(top_chunks)} chunks")
+    
+    messages = [
+        {
+            "role": "system",
+            "content": f"You are a helpful assistant. Answer the query using the provided forum posts from {date_range or FORUM_DATE_RANGE}. Cite Post URLs (e.g., https://discourse.onlinedegree.iitm.ac.in/t/...) where relevant. If the answer isn't in the context, state so."
+        },
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": f"**Context**:\n{context}\n\n**Query**:\n{query}"}
+            ]
+        }
+    ]
+    
+    if image:
+        messages[1]["content"].append({"type": "image_url", "image_url": {"url": image["url"]}})
+        logging.info(f"Added image {image['digest'][:12]} to Open AI request")
+    return messages, context_tokens
+
+def build_links(top_chunks):
+    """Build the response links for the top chunks."""
+    return [
+        {"url": f"{BASE_URL}{chunk['post_url']}", "text": chunk["preview"]}
+        for chunk in top_chunks
+    ]
+
+def record_usage(usage):
+    """Count the prompt and completion tokens reported by an LLM response."""
+    if usage is not None:
+        metrics.tokens_total.inc("prompt", amount=usage.prompt_tokens or 0)
+        metrics.tokens_total.inc("completion", amount=usage.completion_tokens or 0)
+
+async def query_llm(query, top_chunks, image: Optional[dict] = None, date_range: Optional[str] = None):
     """Query Open AI LLM via proxy with top chunks and optional image."""
     try:
         if not top_chunks:
             logging.warning("No chunks found for query")
-            return "No relevant chunks found to answer the query.", []
-        
-        context = "\n\n".join(
-            f"Post URL: {BASE_URL}{chunk['post_url']}\nContent:\n{chunk['content']}"
-            for chunk in top_chunks
-        )
-        
-        messages = [
-            {
-                "role": "system",
-                "content": "You are a helpful assistant. Answer the query using the provided forum posts from January 1 to April 15, 2025. Cite Post URLs (e.g., https://discourse.onlinedegree.iitm.ac.in/t/...) where relevant. If the answer isn't in the context, state so."
-            },
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": f"**Context**:\n{context}\n\n**Query**:\n{query}"}
-                ]
-            }
-        ]
-        
-        if image_base64:
-            try:
-                base64.b64decode(image_base64)
-                messages[1]["content"].append({
-                    "type": "image_url",
-                    "image_url": {"url": f"data:image/webp;base64,{image_base64}"}
-                })
-                logging.info(f"Added base64 image to Open AI request")
-            except Exception as e:
-                logging.error(f"Error decoding base64 image: {str(e)}")
-                messages[1]["content"].append({
-                    "type": "text",
-                    "text": "\n\n[Error processing image: Image content could not be decoded.]"
-                })
+            return NO_CHUNKS_ANSWER, []
         
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            temperature=0.7,
-            max_tokens=500
-        )
+        messages, context_tokens = build_messages(query, top_chunks, image, date_range)
+        async with upstream_slots:
+            with stage("llm"):
+                response = await client.chat.completions.create(
+                    model=LLM_MODEL,
+                    messages=messages,
+                    temperature=0.7,
+                    max_tokens=500,
+                    timeout=LLM_TIMEOUT
+                )
+        record_usage(response.usage)
         answer = response.choices[0].message.content.strip()
-        links = [
-            {"url": f"{BASE_URL}{chunk['post_url']}", "text": chunk["preview"]}
-            for chunk in top_chunks
-        ]
-        logging.info(f"Generated answer for query: {query}")
+        links = build_links(top_chunks)
+        prompt_tokens = response.usage.prompt_tokens if response.usage else None
+        logging.info(f"Generated answer for query: {query} (context tokens: {context_tokens}, prompt tokens: {prompt_tokens})")
         return answer, links
     except Exception as e:
         logging.error(f"Error querying LLM: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error querying LLM: {str(e)}")
 
+async def stream_llm(query, top_chunks, image: Optional[dict] = None, date_range: Optional[str] = None):
+    """Yield answer text deltas from a streamed Open AI completion.
+
+    A task reads the upstream stream into a queue, so its upstream_slots slot
+    is released as soon as the completion ends rather than once a slow client
+    has read every delta.
+    """
+    messages, _ = build_messages(query, top_chunks, image, date_range)
+    deltas = asyncio.Queue()
+
+    async def read_upstream():
+        try:
+            async with upstream_slots:
+                with stage("llm"):
+                    stream = await client.chat.completions.create(
+                        model=LLM_MODEL,
+                        messages=messages,
+                        temperature=0.7,
+                        max_tokens=500,
+                        stream=True,
+                        stream_options={"include_usage": True},
+                        timeout=LLM_TIMEOUT
+                    )
+                    async for chunk in stream:
+                        if chunk.usage is not None:
+                            record_usage(chunk.usage)
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            deltas.put_nowait(chunk.choices[0].delta.content)
+            deltas.put_nowait(None)
+        except Exception as e:
+            deltas.put_nowait(e)
+
+    reader = asyncio.ensure_future(read_upstream())
+    try:
+        while True:
+            delta = await deltas.get()
+            if delta is None:
+                break
+            if isinstance(delta, Exception):
+                raise delta
+            yield delta
+    finally:
+        # A client that disconnects mid-answer stops the upstream read too
+        reader.cancel()
+
+def sse_event(event, data):
+    """Format one server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def answer_query(query, norm_query, top_chunks, store, image: Optional[dict] = None, date_range: Optional[str] = None):
+    """Answer from the semantic cache when possible, otherwise through one shared LLM call.
+
+    Answers about an image are cached under its content hash, so a repeated
+    screenshot with a similar question is not sent to the model again.
+    """
+    if not top_chunks or date_range:
+        return await query_llm(query, top_chunks, image, date_range)
+
+    chunk_ids = answer_cache_key(top_chunks, image)
+    cached = answer_cache.get(norm_query, chunk_ids, store.version)
+    metrics.cache_events.inc("answer", "miss" if cached is None else "hit")
+    if cached is not None:
+        logging.info(f"Answer cache hit for query: {query}")
+        return cached
+
+    async def generate():
+        answer, links = await query_llm(query, top_chunks, image)
+        answer_cache.put(norm_query, chunk_ids, store.version, answer, links)
+        return answer, links
+
+    return await llm_coalescer.run((normalize_question(query), chunk_ids, store.version), generate)
+
+@app.on_event("startup")
+def load_store_on_startup():
+    try:
+        resident_store.get()
+    except Exception as e:
+        logging.error(f"Vector store not loaded at startup: {str(e)}")
+
+@app.on_event("shutdown")
+async def close_upstream_client():
+    await http_client.aclose()
+    embedding_cache.close()
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Stage latency histograms and counters in the Prometheus text format."""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/query")
 async def query_endpoint(request: QueryRequest):
     try:
-        embeddings, chunk_metadata = load_vector_store()
-        top_chunks = retrieve_top_chunks(request.question, embeddings, chunk_metadata, k=5)
-        answer, links = query_llm(request.question, top_chunks, request.image)
+        image = await prepare_image(request.image)
+        store = await run_in_threadpool(load_vector_store)
+        norm_query = await embed_query(request.question)
+        mask = filter_mask(store, request.filters)
+        top_chunks = await retrieve_top_chunks(request.question, store, k=5, norm_query=norm_query, mask=mask)
+        answer, links = await answer_query(request.question, norm_query, top_chunks, store, image, describe_date_range(request.filters))
         return {"answer": answer, "links": links}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/query/batch")
+async def query_batch_endpoint(request: BatchQueryRequest):
+    """Answer many questions with one embeddings call and one batched retrieval.
+
+    Results come back in question order. Each is {"answer", "links"} like
+    /query, with "error" instead of an answer when its LLM call failed; with
+    `retrieval_only` each is {"links", "chunks"} and no LLM call is made.
+    """
+    if not request.questions:
+        return {"results": []}
+    if len(request.questions) > MAX_BATCH_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_QUESTIONS} questions per batch")
+    try:
+        store = await run_in_threadpool(load_vector_store)
+        embeddings = await embed_texts(request.questions)
+        norm_queries = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        mask = filter_mask(store, request.filters)
+        batch_chunks = await retrieve_top_chunks_batch(request.questions, store, norm_queries, k=request.k, mask=mask)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+    if request.retrieval_only:
+        return {"results": [
+            {
+                "links": build_links(top_chunks),
+                "chunks": [{"file": chunk["file"], "post_url": chunk["post_url"], "source_urls": chunk["source_urls"], "score": chunk["score"]} for chunk in top_chunks],
+            }
+            for top_chunks in batch_chunks
+        ]}
+
+    slots = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+    date_range = describe_date_range(request.filters)
+
+    async def answer(question, norm_query, top_chunks):
+        async with slots:
+            try:
+                answer, links = await answer_query(question, norm_query, top_chunks, store, date_range=date_range)
+                return {"answer": answer, "links": links}
+            except Exception as e:
+                return {"answer": None, "links": build_links(top_chunks), "error": getattr(e, "detail", str(e))}
+
+    results = await asyncio.gather(*(
+        answer(question, norm_query, top_chunks)
+        for question, norm_query, top_chunks in zip(request.questions, norm_queries, batch_chunks)
+    ))
+    return {"results": results}
+
+@app.post("/query/stream")
+async def query_stream_endpoint(request: QueryRequest):
+    """Stream an answer as server-sent events.
+
+    Events: `links` (sent as soon as retrieval finishes), `token` (answer text
+    deltas), then `done` with the full answer and links, or `error`.
+    """
+    try:
+        image = await prepare_image(request.image)
+        store = await run_in_threadpool(load_vector_store)
+        norm_query = await embed_query(request.question)
+        mask = filter_mask(store, request.filters)
+        top_chunks = await retrieve_top_chunks(request.question, store, k=5, norm_query=norm_query, mask=mask)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    links = build_links(top_chunks)
+    chunk_ids = answer_cache_key(top_chunks, image)
+    date_range = describe_date_range(request.filters)
+    cacheable = not date_range
+
+    async def events():
+        yield sse_event("links", {"links": links})
+        if not top_chunks:
+            yield sse_event("token", {"text": NO_CHUNKS_ANSWER})
+            yield sse_event("done", {"answer": NO_CHUNKS_ANSWER, "links": []})
+            return
+        cached = answer_cache.get(norm_query, chunk_ids, store.version) if cacheable else None
+        if cacheable:
+            metrics.cache_events.inc("answer", "miss" if cached is None else "hit")
+        if cached is not None:
+            yield sse_event("token", {"text": cached[0]})
+            yield sse_event("done", {"answer": cached[0], "links": cached[1]})
+            return
+        try:
+            parts = []
+            async for delta in stream_llm(request.question, top_chunks, image, date_range):
+                parts.append(delta)
+                yield sse_event("token", {"text": delta})
+            answer = "".join(parts).strip()
+            if cacheable and answer:
+                answer_cache.put(norm_query, chunk_ids, store.version, answer, links)
+            logging.info(f"Streamed answer for query: {request.question}")
+            yield sse_event("done", {"answer": answer, "links": links})
+        except Exception as e:
+            logging.error(f"Error streaming LLM answer: {str(e)}")
+            yield sse_event("error", {"detail": f"Error querying LLM: {str(e)}"})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,131 @@
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in seconds, from sub-millisecond scoring to slow LLM calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_labels(labelnames, values):
+    if not labelnames:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in zip(labelnames, values)) + "}"
+
+def format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class Counter:
+    """Monotonic counter with optional labels, rendered in Prometheus text format."""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}")
+        return lines
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels, rendered in Prometheus text format."""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (+Inf last), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ("le",)
+        with self._lock:
+            for labels, (counts, total) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{self.name}_bucket{format_labels(names, labels + (le,))} {cumulative}")
+                lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {total!r}")
+                lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Return every registered metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+stage_seconds = registry.register(Histogram("rag_stage_seconds", "Time spent in each query pipeline stage.", ("stage",)))
+stage_errors = registry.register(Counter("rag_stage_errors_total", "Pipeline stage failures.", ("stage",)))
+request_seconds = registry.register(Histogram("rag_request_seconds", "End-to-end HTTP request latency.", ("path",)))
+requests_total = registry.register(Counter("rag_requests_total", "HTTP requests by path and status code.", ("path", "status")))
+cache_events = registry.register(Counter("rag_cache_events_total", "Cache lookups by cache and result.", ("cache", "result")))
+tokens_total = registry.register(Counter("rag_tokens_total", "Tokens used, by kind (context, prompt, completion).", ("kind",)))
+
+# Per-request {stage: seconds}; a mutable dict so tasks spawned by a request add to it
+request_timings = contextvars.ContextVar("request_timings", default=None)
+
+def start_request_timing():
+    """Begin collecting stage timings for the current request; returns the dict they accumulate in."""
+    timings = {}
+    request_timings.set(timings)
+    return timings
+
+def record_stage(name, seconds):
+    stage_seconds.observe(seconds, name)
+    timings = request_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+@contextmanager
+def stage(name):
+    """Time a block as pipeline stage `name`, counting it as a stage error if it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        stage_errors.inc(name)
+        raise
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+def format_timings(timings, total=None):
+    """Render stage timings as an X-Timing header value in milliseconds, e.g. "embed=12.3;score=0.8;total=20.1"."""
+    parts = [f"{name}={seconds * 1000:.1f}" for name, seconds in timings.items()]
+    if total is not None:
+        parts.append(f"total={total * 1000:.1f}")
+    return ";".join(parts)
@@ -0,0 +1,376 @@
+import os
+import sys
+import json
+import time
+import math
+import argparse
+import logging
+import numpy as np
+from vector_store import dot_rows, dot_rows_batch, load_snapshot, store_dir
+from lexical import BM25Index
+from columns import MetadataColumns
+
+# Search backend: "exact" scans the matrix (honouring SCORING_MODE), "hnsw" and
+# "ivf" query an approximate index persisted with the store version
+RETRIEVAL_BACKEND = os.environ.get("RETRIEVAL_BACKEND", "exact")
+# Scoring mode: "exact" scans the full-precision matrix, "int8"/"float16" scan
+# the quantized copy and optionally rescore the best candidates exactly
+SCORING_MODE = os.environ.get("SCORING_MODE", "exact")
+# Candidates taken from the quantized scan per requested result
+RESCORE_FACTOR = int(os.environ.get("RESCORE_FACTOR", "4"))
+# Whether quantized candidates are rescored against the full-precision rows
+RESCORE = os.environ.get("RESCORE", "1") not in ("0", "false", "False")
+# Search-time knobs of the approximate backends
+HNSW_EF_SEARCH = int(os.environ.get("HNSW_EF_SEARCH", "64"))
+IVF_NPROBE = int(os.environ.get("IVF_NPROBE", "8"))
+
+# Fusion of vector and BM25 results: "none" (vector only) or "rrf"
+RETRIEVAL_FUSION = os.environ.get("RETRIEVAL_FUSION", "none")
+# Candidates taken from each ranking before fusion, and the RRF rank constant
+HYBRID_CANDIDATES = int(os.environ.get("HYBRID_CANDIDATES", "50"))
+RRF_K = int(os.environ.get("RRF_K", "60"))
+# When fewer than this fraction of rows pass a filter, only those rows are
+# gathered and scored; otherwise the full matrix is scanned and the rest masked out
+FILTER_GATHER_FRACTION = 0.5
+# Upper bound on the (questions, rows) float32 score matrix of one batched scan;
+# larger batches are scored and reduced to their top-k a block of questions at a time
+BATCH_SCORE_BYTES = int(os.environ.get("BATCH_SCORE_BYTES", str(256 * 1024 * 1024)))
+
+ANN_INDEX_FILE = "ann_{kind}.faiss"
+ANN_KINDS = ("hnsw", "ivf")
+
+def import_faiss():
+    """Import faiss, which is only needed for the approximate backends."""
+    try:
+        import faiss
+    except ImportError:
+        raise ImportError("The hnsw and ivf retrieval backends require faiss (pip install faiss-cpu).")
+    return faiss
+
+def select_top_k(scores, k):
+    """Return indices of the k highest scores, best first, in O(n + k log k)."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(scores, -k)[-k:]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(scores[candidates])[::-1]]
+
+def select_top_k_batch(scores, k):
+    """Row-wise select_top_k over a (queries, rows) score matrix; returns (queries, k) indices."""
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.empty((len(scores), 0), dtype=np.int64)
+    if k < scores.shape[1]:
+        candidates = np.argpartition(scores, -k, axis=1)[:, -k:]
+    else:
+        candidates = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    order = np.argsort(np.take_along_axis(scores, candidates, axis=1), axis=1)[:, ::-1]
+    return np.take_along_axis(candidates, order, axis=1)
+
+def scan_plan(store, mode, mask):
+    """Pick the matrix to scan for a query and how to apply a row mask.
+
+    Returns (matrix, scales, rows, mask, allowed, quantized). With few rows
+    passing the filter, `rows` holds their indices and the matrix is just
+    those rows; otherwise `mask` is applied to the scores of a full scan.
+    """
+    quantized = mode != "exact" and store.quantized is not None
+    if mode != "exact" and not quantized:
+        logging.warning(f"Store has no {mode} copy; falling back to exact scoring")
+    matrix, scales = (store.quantized, store.scales) if quantized else (store.embeddings, None)
+    rows, allowed = None, len(matrix)
+    if mask is not None:
+        allowed = int(np.count_nonzero(mask))
+        if allowed < len(mask) * FILTER_GATHER_FRACTION:
+            rows, mask = np.flatnonzero(mask), None
+            matrix = matrix[rows]
+            scales = scales[rows] if scales is not None else None
+    return matrix, scales, rows, mask, allowed, quantized
+
+def brute_force_search(store, query_embedding, k=5, mode=SCORING_MODE, rescore=RESCORE, rescore_factor=RESCORE_FACTOR, mask=None):
+    """Return (indices, scores) of the k chunks most similar to a normalized query.
+
+    In quantized modes the compact matrix is scanned first and the top
+    `k * rescore_factor` candidates are optionally rescored against the
+    full-precision rows, so only those rows are read from the full matrix.
+    With a boolean row `mask` only chunks passing it are returned.
+    """
+    matrix, scales, rows, mask, allowed, quantized = scan_plan(store, mode, mask)
+    scores = dot_rows(matrix, query_embedding, scales)
+    if mask is not None:
+        scores[~mask] = -np.inf
+    if not quantized or not rescore:
+        top = select_top_k(scores, min(k, allowed))
+        return (top if rows is None else rows[top]), scores[top]
+
+    # Sorted row order keeps the reads from the memory-mapped matrix sequential
+    candidates = select_top_k(scores, min(k * max(rescore_factor, 1), allowed))
+    candidates = np.sort(candidates if rows is None else rows[candidates])
+    exact_scores = dot_rows(store.embeddings[candidates], query_embedding)
+    order = select_top_k(exact_scores, k)
+    return candidates[order], exact_scores[order]
+
+def brute_force_search_batch(store, query_embeddings, k=5, mode=SCORING_MODE, rescore=RESCORE, rescore_factor=RESCORE_FACTOR, mask=None):
+    """brute_force_search for a (queries, dimension) matrix; returns a list of (indices, scores) per query.
+
+    Queries are scored with matrix-matrix products over the exact or
+    quantized matrix, in blocks of questions whose score matrix fits
+    BATCH_SCORE_BYTES; quantized candidates are then rescored per query.
+    """
+    matrix, scales, rows, mask, allowed, quantized = scan_plan(store, mode, mask)
+    block_queries = max(BATCH_SCORE_BYTES // (4 * max(len(matrix), 1)), 1)
+    results = []
+    for start in range(0, len(query_embeddings), block_queries):
+        queries = query_embeddings[start:start + block_queries]
+        scores = dot_rows_batch(matrix, queries, scales)
+        if mask is not None:
+            scores[:, ~mask] = -np.inf
+        if not quantized or not rescore:
+            top = select_top_k_batch(scores, min(k, allowed))
+            results.extend(zip(top if rows is None else rows[top], np.take_along_axis(scores, top, axis=1)))
+            continue
+        for query, candidates in zip(queries, select_top_k_batch(scores, min(k * max(rescore_factor, 1), allowed))):
+            candidates = np.sort(candidates if rows is None else rows[candidates])
+            exact_scores = dot_rows(store.embeddings[candidates], query)
+            order = select_top_k(exact_scores, k)
+            results.append((candidates[order], exact_scores[order]))
+    return results
+
+class ExactBackend:
+    """Brute-force scan of the store, optionally over its quantized copy."""
+
+    def __init__(self, store, mode=SCORING_MODE, rescore=RESCORE, rescore_factor=RESCORE_FACTOR):
+        self.store = store
+        self.mode = mode
+        self.rescore = rescore
+        self.rescore_factor = rescore_factor
+
+    def search(self, query_embedding, k=5, mask=None):
+        return brute_force_search(self.store, query_embedding, k, mode=self.mode, rescore=self.rescore, rescore_factor=self.rescore_factor, mask=mask)
+
+    def search_batch(self, query_embeddings, k=5, mask=None):
+        return brute_force_search_batch(self.store, query_embeddings, k, mode=self.mode, rescore=self.rescore, rescore_factor=self.rescore_factor, mask=mask)
+
+class FaissBackend:
+    """Approximate search over the HNSW or IVF index stored with a store version.
+
+    Indexes use inner product on normalized rows, so scores are cosine
+    similarities like the exact backend's. `ef_search` (HNSW) and `nprobe`
+    (IVF) trade recall for latency at query time. Filtered searches scan the
+    rows passing the filter exactly instead of querying the graph.
+    """
+
+    def __init__(self, store, kind, ef_search=HNSW_EF_SEARCH, nprobe=IVF_NPROBE):
+        if kind not in ANN_KINDS:
+            raise ValueError(f"Unknown ANN index kind {kind}; expected one of {ANN_KINDS}")
+        faiss = import_faiss()
+        index_path = os.path.join(store.path or "", ANN_INDEX_FILE.format(kind=kind))
+        if not os.path.exists(index_path):
+            raise FileNotFoundError(f"{index_path} not found; rebuild the store with --index {kind}")
+        self.store = store
+        self.kind = kind
+        self.index = faiss.read_index(index_path)
+        if self.index.ntotal != len(store):
+            raise ValueError(f"{index_path} holds {self.index.ntotal} vectors for {len(store)} chunks")
+        if kind == "hnsw":
+            self.index.hnsw.efSearch = ef_search
+        else:
+            self.index.nprobe = nprobe
+
+    def search(self, query_embedding, k=5, mask=None):
+        if mask is not None:
+            return brute_force_search(self.store, query_embedding, k, mode="exact", mask=mask)
+        query = np.asarray(query_embedding, dtype=np.float32).reshape(1, -1)
+        scores, indices = self.index.search(query, k)
+        found = indices[0] >= 0
+        return indices[0][found].astype(np.int64), scores[0][found]
+
+    def search_batch(self, query_embeddings, k=5, mask=None):
+        if mask is not None:
+            return brute_force_search_batch(self.store, query_embeddings, k, mode="exact", mask=mask)
+        queries = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+        scores, indices = self.index.search(queries, k)
+        found = indices >= 0
+        return [(row_indices[row_found].astype(np.int64), row_scores[row_found]) for row_indices, row_scores, row_found in zip(indices, scores, found)]
+
+def make_backend(store, name=RETRIEVAL_BACKEND, **params):
+    """Create the configured search backend for a store snapshot."""
+    if name == "exact":
+        return ExactBackend(store, **params)
+    if name in ANN_KINDS:
+        return FaissBackend(store, name, **params)
+    raise ValueError(f"Unknown retrieval backend {name}; expected exact, hnsw or ivf")
+
+def attach_backend(store):
+    """ResidentStore on_load hook: give a new snapshot its backend, BM25 index and metadata columns.
+
+    A store version without the configured ANN index falls back to the exact
+    backend rather than failing the reload.
+    """
+    try:
+        store.backend = make_backend(store)
+    except (ImportError, FileNotFoundError, ValueError) as e:
+        logging.error(f"Using exact retrieval for store version {store.version}: {str(e)}")
+        store.backend = ExactBackend(store)
+    logging.info(f"Retrieval backend for store version {store.version}: {type(store.backend).__name__}")
+    if store.header.get("bm25"):
+        try:
+            store.lexical = BM25Index.open(store.path, len(store))
+        except (OSError, ValueError) as e:
+            logging.error(f"BM25 index not loaded for store version {store.version}: {str(e)}")
+    if store.header.get("columns"):
+        try:
+            store.columns = MetadataColumns.open(store.path, len(store))
+        except (OSError, ValueError) as e:
+            logging.error(f"Metadata columns not loaded for store version {store.version}: {str(e)}")
+
+def rrf_fuse(rankings, k, rank_constant=RRF_K):
+    """Merge ranked index lists with reciprocal rank fusion; returns (indices, fused scores)."""
+    fused = {}
+    for ranking in rankings:
+        for rank, idx in enumerate(ranking.tolist()):
+            fused[idx] = fused.get(idx, 0.0) + 1.0 / (rank_constant + rank + 1)
+    best = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+    return np.array([idx for idx, _ in best], dtype=np.int64), np.array([score for _, score in best], dtype=np.float32)
+
+def lexical_ranking(store, query_text, candidates, mask=None):
+    """Top BM25 matches of a query with a positive score, restricted to `mask` when given."""
+    lexical_scores = store.lexical.scores(query_text)
+    if mask is not None:
+        lexical_scores[~mask] = 0.0
+    ranking = select_top_k(lexical_scores, candidates)
+    return ranking[lexical_scores[ranking] > 0]
+
+def search(store, query_embedding, k=5, query_text=None, fusion=RETRIEVAL_FUSION, mask=None):
+    """Return (indices, scores) of the top-k chunks using the store's backend.
+
+    With `fusion="rrf"` and a BM25 index in the store, the top
+    HYBRID_CANDIDATES of the vector and lexical rankings are merged with
+    reciprocal rank fusion, and the returned scores are fused RRF scores.
+    A boolean row `mask` restricts both rankings to the chunks passing it.
+    """
+    backend = store.backend or ExactBackend(store)
+    if fusion != "rrf" or store.lexical is None or not query_text:
+        return backend.search(query_embedding, k, mask=mask)
+
+    candidates = max(k, HYBRID_CANDIDATES)
+    vector_ranking, _ = backend.search(query_embedding, candidates, mask=mask)
+    return rrf_fuse([vector_ranking, lexical_ranking(store, query_text, candidates, mask)], k)
+
+def search_batch(store, query_embeddings, k=5, query_texts=None, fusion=RETRIEVAL_FUSION, mask=None):
+    """search() for many queries at once; returns a list of (indices, scores) in query order.
+
+    The vector ranking of every query comes from one batched backend call;
+    with RRF fusion each query's ranking is then fused with its BM25 ranking.
+    """
+    backend = store.backend or ExactBackend(store)
+    hybrid = fusion == "rrf" and store.lexical is not None and query_texts is not None
+    candidates = max(k, HYBRID_CANDIDATES)
+    vector_results = backend.search_batch(query_embeddings, candidates if hybrid else k, mask=mask)
+    if not hybrid:
+        return vector_results
+
+    results = []
+    for (vector_ranking, scores), query_text in zip(vector_results, query_texts):
+        if not query_text:
+            results.append((vector_ranking[:k], scores[:k]))
+            continue
+        results.append(rrf_fuse([vector_ranking, lexical_ranking(store, query_text, candidates, mask)], k))
+    return results
+
+def build_ann_index(embeddings, kind, hnsw_m=32, ef_construction=200, nlist=None):
+    """Build an inner-product HNSW or IVF index over normalized embeddings."""
+    faiss = import_faiss()
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    dimension = embeddings.shape[1]
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = ef_construction
+    elif kind == "ivf":
+        nlist = nlist or max(1, min(len(embeddings) // 39, int(4 * math.sqrt(len(embeddings)))))
+        quantizer = faiss.IndexFlatIP(dimension)
+        index = faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+        index.train(embeddings)
+    else:
+        raise ValueError(f"Unknown ANN index kind {kind}; expected one of {ANN_KINDS}")
+    index.add(embeddings)
+    return index
+
+def ann_index_writer(kind, **params):
+    """Return a write_store writer that persists an ANN index with the version."""
+    def write(version_dir, embeddings):
+        faiss = import_faiss()
+        start = time.perf_counter()
+        index = build_ann_index(embeddings, kind, **params)
+        faiss.write_index(index, os.path.join(version_dir, ANN_INDEX_FILE.format(kind=kind)))
+        logging.info(f"Built {kind} index over {index.ntotal} vectors in {time.perf_counter() - start:.1f}s")
+        return {"ann_index": {"kind": kind, **params}}
+    return write
+
+def recall_report(store, backend, k=5, num_queries=200, noise=0.05, seed=0):
+    """Measure recall@k and latency of a backend against exact scoring.
+
+    Queries are stored embeddings perturbed with Gaussian noise, so the report
+    runs offline without calling the embeddings API. The p50 latencies sit
+    next to recall (with their ratio as "speedup"), since a backend that
+    keeps recall but is not faster than exact scoring only saves memory.
+    """
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(store.embeddings), size=min(num_queries, len(store.embeddings)), replace=False)
+    queries = np.asarray(store.embeddings[np.sort(rows)], dtype=np.float32)
+    queries = queries + rng.normal(scale=noise, size=queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    hits = 0
+    exact_times, approx_times = [], []
+    for query in queries:
+        start = time.perf_counter()
+        exact, _ = brute_force_search(store, query, k, mode="exact")
+        exact_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        approx, _ = backend.search(query, k)
+        approx_times.append(time.perf_counter() - start)
+        hits += len(set(exact.tolist()) & set(approx.tolist()))
+
+    return {
+        "backend": type(backend).__name__,
+        "k": k,
+        "queries": len(queries),
+        "chunks": len(store.embeddings),
+        "recall_at_k": hits / (len(queries) * min(k, len(store.embeddings))),
+        "exact_p50_ms": float(np.percentile(exact_times, 50) * 1000),
+        "approx_p50_ms": float(np.percentile(approx_times, 50) * 1000),
+        "speedup": float(np.percentile(exact_times, 50) / np.percentile(approx_times, 50)),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report recall@k of a quantized or ANN backend against exact scoring.")
+    parser.add_argument("--store", default=store_dir, help="Store directory or legacy .npz file")
+    parser.add_argument("--backend", choices=["int8", "float16", "hnsw", "ivf"], default="int8")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--rescore-factor", type=int, default=RESCORE_FACTOR)
+    parser.add_argument("--no-rescore", action="store_true")
+    parser.add_argument("--ef-search", type=int, default=HNSW_EF_SEARCH)
+    parser.add_argument("--nprobe", type=int, default=IVF_NPROBE)
+    args = parser.parse_args(argv)
+
+    if args.backend in ANN_KINDS:
+        store = load_snapshot(args.store)
+        knobs = {"ef_search": args.ef_search} if args.backend == "hnsw" else {"nprobe": args.nprobe}
+        backend = FaissBackend(store, args.backend, **knobs)
+    else:
+        store = load_snapshot(args.store, quantize=args.backend)
+        knobs = {"rescore": not args.no_rescore, "rescore_factor": args.rescore_factor}
+        backend = ExactBackend(store, mode=args.backend, **knobs)
+
+    report = recall_report(store, backend, k=args.k, num_queries=args.queries)
+    report.update(mode=args.backend, **knobs)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import os
+import shutil
+import asyncio
+import logging
+import argparse
+from datetime import datetime, timezone
+from codefiles import scraper, conv_markdown
+import chunking
+
+# Scratch outputs of one sync run
+delta_dir = "sc_delta"
+delta_markdown = "forum_posts.delta.md"
+
+def previous_build_options(store_dir):
+    """Return the dtype, quantization, ANN index and dedup options of the current store version."""
+    from vector_store import read_current, read_header
+
+    version = read_current(store_dir)
+    if version is None:
+        return {}
+    header = read_header(os.path.join(store_dir, version))
+    ann = dict(header.get("ann_index") or {})
+    kind = ann.pop("kind", None)
+    options = {"dtype": header.get("dtype", "float32"), "quantize": header.get("quantized"), "ann_index": kind, "ann_params": ann}
+    dedup = header.get("dedup")
+    if dedup:
+        options["dedup"] = dedup["mode"]
+        if dedup.get("threshold") is not None:
+            options["dedup_threshold"] = dedup["threshold"]
+    return options
+
+def sync(start_date=conv_markdown.DEFAULT_START, end_date=None, embed=True, **crawl_options):
+    """Fetch new forum posts and carry them through conversion, chunking and embedding.
+
+    The crawl only downloads topics whose posts_count or bumped_at changed
+    since the last run, and only their new posts. Those posts are converted
+    to Markdown on their own, appended to forum_posts.md, chunked onto the
+    end of the existing shards and embedded incrementally, which re-embeds
+    only chunks the store has not seen. Returns the number of new posts.
+    """
+    end_date = end_date or datetime.now(timezone.utc)
+    shutil.rmtree(delta_dir, ignore_errors=True)
+    saved, skipped, failed, new_posts = asyncio.run(scraper.crawl(incremental=True, delta_dir=delta_dir, **crawl_options))
+    print(f"Synced {saved} topics ({new_posts} new posts), {skipped} unchanged, {failed} failed.")
+    if not new_posts:
+        return 0
+
+    counters, errors = conv_markdown.convert(delta_dir, delta_markdown, start_date, end_date, header=False)
+    for error in errors:
+        logging.warning(error)
+    with open(delta_markdown, "r", encoding="utf-8") as src, open(chunking.input_file, "a", encoding="utf-8") as dst:
+        shutil.copyfileobj(src, dst)
+
+    chunk_count, errors = chunking.chunk_markdown(delta_markdown, chunking.output_dir, append=True)
+    for error in errors:
+        logging.warning(error)
+    print(f"Added {chunk_count} chunks from {counters['posts_kept']} posts.")
+
+    if embed and chunk_count:
+        import vercel_npzfile
+
+        vercel_npzfile.generate_embeddings(incremental=True, **previous_build_options(vercel_npzfile.store_dir))
+    return new_posts
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fetch new forum posts and add them to the chunks and vector store.")
+    parser.add_argument("--start", type=conv_markdown.parse_datetime, default=conv_markdown.DEFAULT_START, help="Earliest post time to keep")
+    parser.add_argument("--end", type=conv_markdown.parse_end_datetime, help="Latest post time to keep, inclusive (default: now)")
+    parser.add_argument("--checkpoint", default=scraper.checkpoint_path, help="Per-topic sync state")
+    parser.add_argument("--no-embed", action="store_true", help="Stop after chunking")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    sync(args.start, args.end, embed=not args.no_embed, checkpoint_file=args.checkpoint)
+
+if __name__ == "__main__":
+    main()
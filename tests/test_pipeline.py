@@ -0,0 +1,189 @@
+"""Offline tests of the embedding build and the forum crawler against local stand-ins.
+
+embed_texts runs against benchmarks/fake_openai.py's Ollama /api/embed (or a
+flaky wrapper of it) and scraper.crawl against a small Discourse stub, both
+served with uvicorn on a background thread.
+"""
+import os
+import sys
+import json
+import asyncio
+import pytest
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (REPO_ROOT, os.path.join(REPO_ROOT, "benchmarks")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import vercel_npzfile
+from codefiles import scraper
+from fake_openai import fake_embedding, make_app, serve_in_thread
+
+DIMENSION = 8
+
+@pytest.fixture
+def serve():
+    """Start ASGI apps on background threads; returns a function giving each app's base URL."""
+    servers = []
+
+    def start(app):
+        server, base_url = serve_in_thread(app)
+        servers.append(server)
+        return base_url
+
+    yield start
+    for server in servers:
+        server.should_exit = True
+
+def flaky_embed_app(failures):
+    """fake_openai's /api/embed behind a wrapper that answers the first `failures` calls with 503."""
+    app = make_app(embed_latency=0, chat_latency=0, jitter=0, dimension=DIMENSION)
+    app.state.failures = failures
+
+    @app.middleware("http")
+    async def fail_first_calls(request, call_next):
+        if request.url.path == "/api/embed" and app.state.failures > 0:
+            app.state.failures -= 1
+            return JSONResponse({"error": "overloaded"}, status_code=503)
+        return await call_next(request)
+
+    return app
+
+def test_embed_texts_batches_requests(serve, monkeypatch):
+    app = make_app(embed_latency=0, chat_latency=0, jitter=0, dimension=DIMENSION)
+    monkeypatch.setattr(vercel_npzfile, "OLLAMA_API", serve(app) + "/api")
+    texts = [f"chunk {i}" for i in range(25)]
+
+    embeddings = vercel_npzfile.embed_texts(texts, batch_size=10, concurrency=2)
+
+    assert app.state.calls["ollama_embed"] == 3
+    np.testing.assert_allclose(np.stack(embeddings), [fake_embedding(text, DIMENSION) for text in texts], rtol=1e-6)
+
+def test_embed_texts_retries_failed_batches(serve, monkeypatch):
+    app = flaky_embed_app(failures=2)
+    monkeypatch.setattr(vercel_npzfile, "OLLAMA_API", serve(app) + "/api")
+    monkeypatch.setattr(vercel_npzfile.time, "sleep", lambda seconds: None)
+
+    embeddings = vercel_npzfile.embed_texts([f"chunk {i}" for i in range(4)], batch_size=2, concurrency=1)
+
+    assert all(embedding is not None for embedding in embeddings)
+    assert app.state.calls["ollama_embed"] == 2
+
+def test_embed_texts_marks_batches_that_keep_failing(serve, monkeypatch):
+    app = flaky_embed_app(failures=vercel_npzfile.EMBED_RETRIES + 1)
+    monkeypatch.setattr(vercel_npzfile, "OLLAMA_API", serve(app) + "/api")
+    monkeypatch.setattr(vercel_npzfile.time, "sleep", lambda seconds: None)
+
+    embeddings = vercel_npzfile.embed_texts([f"chunk {i}" for i in range(4)], batch_size=2, concurrency=1)
+
+    assert [embedding is None for embedding in embeddings] == [True, True, False, False]
+
+def make_post(topic_id, number):
+    return {"id": topic_id * 1000 + number, "topic_id": topic_id, "post_number": number, "cooked": f"<p>Post {number}</p>"}
+
+def discourse_app(topics, window=5):
+    """A Discourse stand-in serving a two-page category listing and each topic's post stream.
+
+    `topics` maps topic id to its post count. Topic pages return the first
+    `window` posts with the full id stream, like Discourse. Paths listed in
+    app.state.failures answer 503 that many more times; app.state.calls
+    counts requests per path.
+    """
+    app = FastAPI()
+    app.state.posts = {topic_id: [make_post(topic_id, n) for n in range(1, count + 1)] for topic_id, count in topics.items()}
+    app.state.bumped = {topic_id: "2025-02-01T00:00:00.000Z" for topic_id in topics}
+    app.state.failures = {}
+    app.state.calls = {}
+
+    @app.middleware("http")
+    async def count_and_fail(request, call_next):
+        path = request.url.path
+        app.state.calls[path] = app.state.calls.get(path, 0) + 1
+        if app.state.failures.get(path, 0) > 0:
+            app.state.failures[path] -= 1
+            return JSONResponse({"errors": ["unavailable"]}, status_code=503, headers={"Retry-After": "0"})
+        return await call_next(request)
+
+    def listing_entry(topic_id):
+        posts = app.state.posts[topic_id]
+        return {"id": topic_id, "slug": f"topic-{topic_id}", "posts_count": len(posts), "bumped_at": app.state.bumped[topic_id]}
+
+    @app.get("/c/courses/tds-kb/34.json")
+    async def category(page: int = 0):
+        ids = sorted(app.state.posts)
+        half = (len(ids) + 1) // 2
+        page_ids = (ids[:half], ids[half:], [])[min(page, 2)]
+        topic_list = {"topics": [listing_entry(topic_id) for topic_id in page_ids]}
+        if page == 0:
+            topic_list["more_topics_url"] = "/c/courses/tds-kb/34?page=1"
+        return {"topic_list": topic_list}
+
+    def stream(topic_id, first):
+        posts = app.state.posts[topic_id]
+        return {"post_stream": {"posts": posts[first - 1:first - 1 + window], "stream": [post["id"] for post in posts]}}
+
+    @app.get("/t/{name}")
+    async def topic(name: str):
+        return stream(int(name.removesuffix(".json")), 1)
+
+    @app.get("/t/{topic_id}/{name}")
+    async def topic_part(topic_id: int, name: str, request: Request):
+        if name == "posts.json":
+            wanted = {int(post_id) for post_id in request.query_params.getlist("post_ids[]")}
+            return {"post_stream": {"posts": [post for post in app.state.posts[topic_id] if post["id"] in wanted]}}
+        return stream(topic_id, int(name.removesuffix(".json")))
+
+    return app
+
+def crawl(base_url, tmp_path, **options):
+    return asyncio.run(scraper.crawl(
+        base_url, destination=str(tmp_path / "sc"), checkpoint_file=str(tmp_path / "checkpoint.json"),
+        concurrency=4, rate=0, cookie="", **options,
+    ))
+
+def saved_numbers(tmp_path, topic_id, directory="sc"):
+    with open(tmp_path / directory / f"topic-{topic_id}.json", encoding="utf-8") as f:
+        return [post["post_number"] for post in json.load(f)]
+
+def test_crawl_follows_listing_pages_and_post_batches(serve, tmp_path):
+    app = discourse_app({1: 3, 2: 47, 3: 1})
+
+    assert crawl(serve(app), tmp_path) == (3, 0, 0, 51)
+
+    assert saved_numbers(tmp_path, 2) == list(range(1, 48))
+    # 42 posts beyond the first window take three posts.json batches of up to 20
+    assert app.state.calls["/t/2/posts.json"] == 3
+
+def test_crawl_retries_and_resumes_from_checkpoint(serve, tmp_path):
+    app = discourse_app({1: 3, 2: 4, 3: 2})
+    base_url = serve(app)
+    # Topic 1 recovers after two 503s; topic 3 fails every attempt of the first crawl
+    app.state.failures = {"/t/1.json": 2, "/t/3.json": scraper.SCRAPE_RETRIES + 1}
+
+    assert crawl(base_url, tmp_path) == (2, 0, 1, 7)
+    assert app.state.calls["/t/1.json"] == 3
+    with open(tmp_path / "checkpoint.json", encoding="utf-8") as f:
+        assert sorted(json.load(f)["topics"]) == ["1", "2"]
+
+    # The rerun skips the checkpointed topics and fetches only the failed one
+    assert crawl(base_url, tmp_path) == (1, 2, 0, 2)
+    assert app.state.calls["/t/1.json"] == 3
+    assert app.state.calls["/t/2.json"] == 1
+    assert saved_numbers(tmp_path, 3) == [1, 2]
+
+def test_incremental_crawl_fetches_only_new_posts(serve, tmp_path):
+    app = discourse_app({1: 6, 2: 2})
+    base_url = serve(app)
+    crawl(base_url, tmp_path)
+    app.state.posts[1] += [make_post(1, 7), make_post(1, 8)]
+    app.state.bumped[1] = "2025-03-01T00:00:00.000Z"
+
+    assert crawl(base_url, tmp_path, incremental=True, delta_dir=str(tmp_path / "delta")) == (1, 1, 0, 2)
+
+    assert app.state.calls.get("/t/1.json") == 1
+    assert app.state.calls["/t/1/7.json"] == 1
+    assert saved_numbers(tmp_path, 1) == list(range(1, 9))
+    assert saved_numbers(tmp_path, 1, "delta") == [7, 8]
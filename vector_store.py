@@ -0,0 +1,484 @@
+import os
+import sys
+import json
+import mmap
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+import numpy as np
+
+# Paths and constants
+npz_path = "vector_store.npz"
+store_dir = "vector_store"
+# Seconds between checks of the store on disk for hot reload
+RELOAD_CHECK_INTERVAL = float(os.environ.get("STORE_RELOAD_INTERVAL", "5"))
+# Number of store versions kept on disk after a new one is published
+KEEP_VERSIONS = 2
+# Rows converted to float32 at a time when scoring a float16 or int8 matrix;
+# small enough that each block stays in cache while it is multiplied
+SCORE_BLOCK_ROWS = 2048
+
+FORMAT_VERSION = 1
+HEADER_FILE = "header.json"
+EMBEDDINGS_FILE = "embeddings.bin"
+METADATA_FILE = "metadata.json"
+CURRENT_FILE = "CURRENT"
+QUANTIZED_FILE = "embeddings.quantized.bin"
+SCALES_FILE = "scales.bin"
+CONTENT_FILE = "chunks.bin"
+OFFSETS_FILE = "chunk_offsets.bin"
+MANIFEST_FILE = "manifest.json"
+STORE_DTYPES = {"float32": "<f4", "float16": "<f2"}
+QUANTIZED_DTYPES = {"int8": "i1", "float16": "<f2"}
+
+class VectorStore:
+    """Immutable snapshot of the embeddings and metadata loaded from disk.
+
+    Embeddings are L2-normalized, so cosine similarity is a plain dot product
+    against a normalized query vector. For the directory format the matrix is a
+    read-only np.memmap shared through the page cache by every worker.
+
+    Optionally it also carries a compact `quantized` copy of the matrix (int8
+    with per-row `scales`, or float16) used for fast candidate selection, and a
+    `content` pack holding every chunk's text.
+    """
+
+    def __init__(self, embeddings, metadata, version, header=None, path=None, quantized=None, scales=None, content=None):
+        self.embeddings = embeddings
+        self.metadata = metadata
+        self.version = version
+        self.header = header or {}
+        self.path = path
+        self.quantized = quantized
+        self.scales = scales
+        # ContentPack with the chunk texts, when the version has one
+        self.content = content
+        # Search backend, BM25 index and metadata columns attached by the ResidentStore's on_load hook
+        self.backend = None
+        self.lexical = None
+        self.columns = None
+
+    def __len__(self):
+        return len(self.metadata)
+
+class ContentPack:
+    """Chunk texts packed into one file and sliced through mmap.
+
+    `offsets` holds count + 1 byte offsets, so chunk i is
+    data[offsets[i]:offsets[i + 1]]. Reads are page-cache slices with no
+    open() or read() syscalls on the request path.
+    """
+
+    def __init__(self, version_dir, count):
+        self.offsets = map_matrix(os.path.join(version_dir, OFFSETS_FILE), "<i8", (count + 1,))
+        with open(os.path.join(version_dir, CONTENT_FILE), "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size != int(self.offsets[-1]):
+                raise ValueError(f"Invalid {CONTENT_FILE} in {version_dir}: expected {int(self.offsets[-1])} bytes.")
+            # The mapping stays valid after the file object is closed
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def get(self, idx):
+        """Return the text of chunk `idx`."""
+        return self._data[int(self.offsets[idx]):int(self.offsets[idx + 1])].decode("utf-8")
+
+def content_pack_writer(texts):
+    """Return a write_store writer that packs chunk texts, in row order, into the version."""
+    def write(version_dir, embeddings):
+        if len(texts) != len(embeddings):
+            raise ValueError(f"Expected one text per embedding row, got {len(texts)} for {len(embeddings)}")
+        offsets = np.zeros(len(texts) + 1, dtype="<i8")
+        with open(os.path.join(version_dir, CONTENT_FILE), "wb") as f:
+            for i, text in enumerate(texts):
+                data = text.encode("utf-8")
+                f.write(data)
+                offsets[i + 1] = offsets[i] + len(data)
+        offsets.tofile(os.path.join(version_dir, OFFSETS_FILE))
+        return {"content_pack": True}
+    return write
+
+def manifest_writer(entries, model):
+    """Return a write_store writer that records each row's chunk file and content hash.
+
+    `entries` holds one {"file", "sha256"} dict per embedding row; the next
+    build compares against it to embed only new or changed chunks.
+    """
+    def write(version_dir, embeddings):
+        if len(entries) != len(embeddings):
+            raise ValueError(f"Expected one manifest entry per embedding row, got {len(entries)} for {len(embeddings)}")
+        with open(os.path.join(version_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump({"model": model, "chunks": entries}, f, ensure_ascii=False, separators=(",", ":"))
+        return {"manifest": True}
+    return write
+
+def read_manifest(version_dir):
+    """Read a version's manifest.json, or return None if it has none."""
+    try:
+        with open(os.path.join(version_dir, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def normalize_rows(embeddings):
+    """Return a float32 copy of the matrix with every row scaled to unit length."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return embeddings / norms
+
+def dot_rows(embeddings, vector, scales=None):
+    """Dot every row of the matrix with `vector`, returning float32 scores.
+
+    float32 matrices go straight to BLAS. Other dtypes (float16, int8) are
+    upcast block by block into one reused scratch buffer and scored into a
+    preallocated output, so only the compact matrix is streamed from memory
+    and a query never materializes a full float32 copy. `scales` holds the
+    per-row factors of an int8 matrix.
+    """
+    vector = np.asarray(vector, dtype=np.float32)
+    if embeddings.dtype == np.float32:
+        scores = np.dot(embeddings, vector)
+    else:
+        scores = np.empty(len(embeddings), dtype=np.float32)
+        scratch = np.empty((min(SCORE_BLOCK_ROWS, len(embeddings)), embeddings.shape[1]), dtype=np.float32)
+        for start in range(0, len(embeddings), SCORE_BLOCK_ROWS):
+            rows = embeddings[start:start + SCORE_BLOCK_ROWS]
+            block = scratch[:len(rows)]
+            np.copyto(block, rows, casting="unsafe")
+            np.dot(block, vector, out=scores[start:start + len(rows)])
+    if scales is not None:
+        scores *= scales
+    return scores
+
+def dot_rows_batch(embeddings, queries, scales=None):
+    """Score every row of the matrix against each query row, returning a (queries, rows) float32 matrix.
+
+    One matrix-matrix product replaces a matrix-vector product per query;
+    non-float32 matrices are upcast through a scratch block as in dot_rows.
+    The result holds queries x rows floats, so callers pass bounded blocks
+    of queries for large stores.
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    if embeddings.dtype == np.float32:
+        scores = np.dot(queries, np.asarray(embeddings).T)
+    else:
+        scores = np.empty((len(queries), len(embeddings)), dtype=np.float32)
+        scratch = np.empty((min(SCORE_BLOCK_ROWS, len(embeddings)), embeddings.shape[1]), dtype=np.float32)
+        for start in range(0, len(embeddings), SCORE_BLOCK_ROWS):
+            rows = embeddings[start:start + SCORE_BLOCK_ROWS]
+            block = scratch[:len(rows)]
+            np.copyto(block, rows, casting="unsafe")
+            scores[:, start:start + len(rows)] = np.dot(queries, block.T)
+    if scales is not None:
+        scores *= scales
+    return scores
+
+def quantize_rows(embeddings, mode):
+    """Return a compact (matrix, scales) copy of normalized embeddings.
+
+    "int8" stores each row as round(x / scale) with scale = max|x| / 127, so
+    scores are recovered as scale * dot(codes, query). "float16" is a plain
+    cast and has no scales.
+    """
+    if mode not in QUANTIZED_DTYPES:
+        raise ValueError(f"Unsupported quantization {mode}; expected one of {sorted(QUANTIZED_DTYPES)}")
+    if mode == "float16":
+        return np.asarray(embeddings, dtype=np.float16), None
+
+    codes = np.empty(embeddings.shape, dtype=np.int8)
+    scales = np.empty(len(embeddings), dtype=np.float32)
+    for start in range(0, len(embeddings), SCORE_BLOCK_ROWS):
+        block = np.asarray(embeddings[start:start + SCORE_BLOCK_ROWS], dtype=np.float32)
+        block_scales = np.abs(block).max(axis=1) / 127.0 if block.size else np.empty(0, dtype=np.float32)
+        block_scales[block_scales == 0] = 1.0
+        codes[start:start + len(block)] = np.clip(np.rint(block / block_scales[:, None]), -127, 127)
+        scales[start:start + len(block)] = block_scales
+    return codes, scales
+
+def read_npz(path):
+    """Read raw embeddings and metadata from a vector_store.npz file."""
+    with np.load(path, allow_pickle=True) as data:
+        if "embeddings" not in data or "metadata" not in data:
+            raise ValueError(f"Invalid {path}: missing keys.")
+
+        embeddings = data["embeddings"]
+        metadata = data["metadata"]
+
+        if isinstance(metadata, np.ndarray):
+            metadata = metadata.item() if metadata.size == 1 else metadata[0]
+
+        chunk_metadata = json.loads(metadata)
+
+    if len(embeddings) != len(chunk_metadata):
+        raise ValueError(f"Invalid {path}: {len(embeddings)} embeddings for {len(chunk_metadata)} metadata entries.")
+    return embeddings, chunk_metadata
+
+def write_store(path, embeddings, metadata, model, dtype="float32", quantize=None, writers=()):
+    """Publish embeddings and metadata as a new version of the store at `path`.
+
+    Each version is a directory holding header.json, the raw little-endian
+    matrix (rows normalized) and compact metadata.json, plus a quantized copy
+    of the matrix when `quantize` is "int8" or "float16". Each callable in
+    `writers` is called as writer(version_dir, embeddings) to add its own files
+    (ANN index, ...) and may return a dict merged into the header. The CURRENT
+    pointer is swapped with os.replace only after the version is fully
+    written, so readers never observe a partial store. Returns the new version
+    directory.
+    """
+    if dtype not in STORE_DTYPES:
+        raise ValueError(f"Unsupported store dtype {dtype}; expected one of {sorted(STORE_DTYPES)}")
+    embeddings = normalize_rows(embeddings)
+    if embeddings.ndim != 2 or len(embeddings) != len(metadata):
+        raise ValueError(f"Expected one embedding row per metadata entry, got {embeddings.shape} for {len(metadata)}")
+
+    os.makedirs(path, exist_ok=True)
+    version = "v" + datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    version_dir = os.path.join(path, version)
+    os.makedirs(version_dir)
+
+    embeddings.astype(STORE_DTYPES[dtype]).tofile(os.path.join(version_dir, EMBEDDINGS_FILE))
+    with open(os.path.join(version_dir, METADATA_FILE), "w", encoding="utf-8") as f:
+        json.dump(metadata, f, ensure_ascii=False, separators=(",", ":"))
+    if quantize:
+        quantized, scales = quantize_rows(embeddings, quantize)
+        quantized.astype(QUANTIZED_DTYPES[quantize]).tofile(os.path.join(version_dir, QUANTIZED_FILE))
+        if scales is not None:
+            scales.astype("<f4").tofile(os.path.join(version_dir, SCALES_FILE))
+    header = {
+        "format": FORMAT_VERSION,
+        "dimension": int(embeddings.shape[1]),
+        "count": int(embeddings.shape[0]),
+        "dtype": dtype,
+        "model": model,
+        "normalized": True,
+        "quantized": quantize,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+    for writer in writers:
+        header.update(writer(version_dir, embeddings) or {})
+    with open(os.path.join(version_dir, HEADER_FILE), "w", encoding="utf-8") as f:
+        json.dump(header, f, indent=2)
+
+    tmp_current = os.path.join(path, f"{CURRENT_FILE}.tmp")
+    with open(tmp_current, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp_current, os.path.join(path, CURRENT_FILE))
+    logging.info(f"Published store version {version} ({header['count']} x {header['dimension']} {dtype})")
+
+    prune_versions(path, keep=KEEP_VERSIONS)
+    return version_dir
+
+def prune_versions(path, keep=KEEP_VERSIONS):
+    """Delete all but the newest `keep` version directories, never the current one.
+
+    Workers that still map an older version keep working: on POSIX an unlinked
+    file stays readable until its last mapping is closed.
+    """
+    current = read_current(path)
+    versions = sorted(d for d in os.listdir(path) if d.startswith("v") and os.path.isdir(os.path.join(path, d)))
+    for version in versions[:-keep] if keep else versions:
+        if version == current:
+            continue
+        version_dir = os.path.join(path, version)
+        try:
+            for name in os.listdir(version_dir):
+                os.remove(os.path.join(version_dir, name))
+            os.rmdir(version_dir)
+            logging.info(f"Removed old store version {version}")
+        except OSError as e:
+            logging.warning(f"Could not remove old store version {version}: {str(e)}")
+
+def read_current(path):
+    """Return the name of the current version in a store directory, or None."""
+    try:
+        with open(os.path.join(path, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def read_header(version_dir):
+    """Read and validate a version's header.json."""
+    with open(os.path.join(version_dir, HEADER_FILE), "r", encoding="utf-8") as f:
+        header = json.load(f)
+    if header.get("format") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported store format {header.get('format')} in {version_dir}")
+    if header.get("dtype") not in STORE_DTYPES:
+        raise ValueError(f"Unsupported store dtype {header.get('dtype')} in {version_dir}")
+    return header
+
+def open_version(version_dir):
+    """Open a store version with the embedding matrix memory-mapped read-only."""
+    header = read_header(version_dir)
+    count, dimension = header["count"], header["dimension"]
+    with open(os.path.join(version_dir, METADATA_FILE), "r", encoding="utf-8") as f:
+        chunk_metadata = json.load(f)
+    if len(chunk_metadata) != count:
+        raise ValueError(f"Invalid {version_dir}: header count {count} but {len(chunk_metadata)} metadata entries.")
+
+    embeddings = map_matrix(os.path.join(version_dir, EMBEDDINGS_FILE), STORE_DTYPES[header["dtype"]], (count, dimension))
+    if not header.get("normalized"):
+        embeddings = normalize_rows(embeddings)
+    return embeddings, chunk_metadata, header
+
+def open_quantized(version_dir, header):
+    """Memory-map the quantized copy of a version, or return (None, None) if it has none."""
+    mode = header.get("quantized")
+    if not mode:
+        return None, None
+    count, dimension = header["count"], header["dimension"]
+    quantized = map_matrix(os.path.join(version_dir, QUANTIZED_FILE), QUANTIZED_DTYPES[mode], (count, dimension))
+    scales = None
+    if mode == "int8":
+        scales = map_matrix(os.path.join(version_dir, SCALES_FILE), "<f4", (count,))
+    return quantized, scales
+
+def map_matrix(path, dtype, shape):
+    """Memory-map a raw little-endian array read-only after checking its size."""
+    dtype = np.dtype(dtype)
+    expected_size = int(np.prod(shape)) * dtype.itemsize
+    if os.path.getsize(path) != expected_size:
+        raise ValueError(f"Invalid {path}: expected {expected_size} bytes.")
+    if not expected_size:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+def store_stamp(path):
+    """Return a cheap identifier that changes whenever the store at `path` is republished."""
+    if os.path.isdir(path):
+        version = read_current(path)
+        if version is None:
+            raise FileNotFoundError(f"{os.path.join(path, CURRENT_FILE)} not found on server.")
+        return version
+    return os.stat(path).st_mtime_ns
+
+def load_snapshot(path, quantize=None):
+    """Load a store directory (or a legacy .npz file) into a new VectorStore snapshot.
+
+    With `quantize` set, the snapshot also gets a quantized copy of the matrix:
+    the one stored with the version when it matches, otherwise one computed in
+    memory for this process.
+    """
+    quantized = scales = content = None
+    if os.path.isdir(path):
+        version = read_current(path)
+        if version is None:
+            raise FileNotFoundError(f"{os.path.join(path, CURRENT_FILE)} not found on server.")
+        version_dir = os.path.join(path, version)
+        embeddings, chunk_metadata, header = open_version(version_dir)
+        if quantize and header.get("quantized") == quantize:
+            quantized, scales = open_quantized(version_dir, header)
+        if header.get("content_pack"):
+            content = ContentPack(version_dir, header["count"])
+    else:
+        version = os.stat(path).st_mtime_ns
+        embeddings, chunk_metadata = read_npz(path)
+        embeddings = normalize_rows(embeddings)
+        header, version_dir = {}, path
+    if quantize and quantized is None:
+        quantized, scales = quantize_rows(embeddings, quantize)
+    snapshot = VectorStore(embeddings, chunk_metadata, version, header=header, path=version_dir, quantized=quantized, scales=scales, content=content)
+    logging.info(f"Loaded {len(chunk_metadata)} metadata entries and embeddings from {path} (version {version}).")
+    return snapshot
+
+class ResidentStore:
+    """Process-wide holder of the current VectorStore snapshot.
+
+    The store is loaded once and kept in memory. `get()` checks the store's
+    stamp (the CURRENT pointer, or the mtime of a legacy .npz) at most every
+    `check_interval` seconds and, when it changed, builds a complete new
+    snapshot before swapping the reference. Requests that already hold the
+    previous snapshot keep using it until they finish. A failed reload keeps
+    serving the last good snapshot.
+
+    `on_load(snapshot)` runs on every freshly loaded snapshot before it is
+    swapped in, so per-snapshot state (such as a search index) is ready before
+    the first request sees it.
+    """
+
+    def __init__(self, path=store_dir, check_interval=RELOAD_CHECK_INTERVAL, quantize=None, on_load=None):
+        self.path = path
+        self.quantize = quantize
+        self.on_load = on_load
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Return the current snapshot, reloading it first if the store changed."""
+        if self._snapshot is None or time.monotonic() - self._last_check >= self.check_interval:
+            self.reload_if_changed()
+        return self._snapshot
+
+    def reload_if_changed(self):
+        """Reload the store if it changed since the current snapshot was loaded."""
+        with self._lock:
+            self._last_check = time.monotonic()
+            current = self._snapshot
+            try:
+                stamp = store_stamp(self.path)
+            except FileNotFoundError:
+                if current is None:
+                    raise FileNotFoundError(f"{self.path} not found on server.")
+                logging.warning(f"{self.path} disappeared; keeping the loaded snapshot")
+                return current
+
+            if current is not None and current.version == stamp:
+                return current
+
+            try:
+                snapshot = load_snapshot(self.path, quantize=self.quantize)
+                if self.on_load is not None:
+                    self.on_load(snapshot)
+            except Exception as e:
+                if current is None:
+                    raise
+                logging.error(f"Failed to reload {self.path}, keeping the loaded snapshot: {str(e)}")
+                return current
+
+            self._snapshot = snapshot
+            return snapshot
+
+def convert_npz(source=npz_path, destination=store_dir, model="nomic-embed-text", dtype="float32", quantize=None, chunks_dir="chunks"):
+    """Convert a legacy vector_store.npz into the memory-mapped directory format.
+
+    When the chunk files listed in the metadata are present under `chunks_dir`
+    they are packed into the new version with precomputed previews and
+    metadata columns.
+    """
+    from chunk_format import extract_content_preview
+    from chunking import shard_dirname, read_chunk_text
+    from columns import columns_writer
+
+    embeddings, chunk_metadata = read_npz(source)
+    writers = []
+    def chunk_exists(entry):
+        if entry.get("shard"):
+            return os.path.exists(os.path.join(chunks_dir, shard_dirname, entry["shard"]))
+        return os.path.exists(os.path.join(chunks_dir, entry["file"]))
+    if all(chunk_exists(entry) for entry in chunk_metadata):
+        texts = []
+        for entry in chunk_metadata:
+            texts.append(read_chunk_text(chunks_dir, entry))
+            entry["preview"] = extract_content_preview(texts[-1])
+        writers.append(content_pack_writer(texts))
+        writers.append(columns_writer(texts, chunk_metadata))
+    else:
+        logging.warning(f"Chunk files missing from {chunks_dir}; converting without a content pack or metadata columns")
+    return write_store(destination, embeddings, chunk_metadata, model=model, dtype=dtype, quantize=quantize, writers=writers)
+
+if __name__ == "__main__":
+    # Usage: python vector_store.py [source.npz] [destination_dir] [float32|float16] [int8|float16]
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    args = sys.argv[1:]
+    version_dir = convert_npz(
+        args[0] if len(args) > 0 else npz_path,
+        args[1] if len(args) > 1 else store_dir,
+        dtype=args[2] if len(args) > 2 else "float32",
+        quantize=args[3] if len(args) > 3 else None,
+    )
+    print(f"Wrote {version_dir}")
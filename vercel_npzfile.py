@@ -1,138 +1,340 @@
 import os
-import json
+import time
+import hashlib
 import numpy as np
-import faiss
 import requests
+from requests.adapters import HTTPAdapter
 import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from vector_store import write_store, open_version, read_current, read_npz, read_manifest, content_pack_writer, manifest_writer
+from chunk_format import extract_content_preview
+from chunking import shard_dirname, read_shard_index, iter_shard_chunks, read_chunk_text
+from retrieval import ann_index_writer, select_top_k
+from lexical import bm25_writer
+from columns import columns_writer
+from dedup import DEDUP_MODES, DEDUP_THRESHOLD, deduplicate, format_report, dedup_writer
 
 # Set up logging
-logging.basicConfig(filename="embed_and_query.log", level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s")
+logging.basicConfig(filename="embed_and_query.log", level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
 # Ollama API endpoint
-OLLAMA_API = "http://localhost:11434/api"
+OLLAMA_API = os.environ.get("OLLAMA_API", "http://localhost:11434/api")
+
+# Embedding model served by Ollama
+EMBED_MODEL = "nomic-embed-text"
+
+# Batching: chunks per /api/embed request, requests in flight, retries per batch
+EMBED_BATCH_SIZE = 32
+EMBED_CONCURRENCY = 4
+EMBED_RETRIES = 3
+EMBED_TIMEOUT = 120
+# Seconds between progress reports
+PROGRESS_INTERVAL = 10
 
 # Paths
 chunks_dir = "chunks"
 npz_path = "vector_store.npz"
+store_dir = "vector_store"
+
+def make_session(pool_size=EMBED_CONCURRENCY):
+    """Create a requests session whose connection pool fits `pool_size` concurrent calls."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+session = make_session()
 
 def embed_text(text):
     """Generate embedding using Ollama."""
     try:
-        response = requests.post(
+        response = session.post(
             f"{OLLAMA_API}/embeddings",
-            json={"model": "nomic-embed-text", "prompt": text}
+            json={"model": EMBED_MODEL, "prompt": text},
+            timeout=EMBED_TIMEOUT
         )
         response.raise_for_status()
-        embedding = np.array(response.json()["embedding"], dtype=np.float32)
-        logging.info(f"Embedded text (length: {len(text)})")
-        return embedding
+        return np.array(response.json()["embedding"], dtype=np.float32)
     except Exception as e:
         logging.error(f"Error embedding text: {str(e)}")
         return None
 
-def generate_embeddings():
-    """Generate embeddings for chunks and save as NPZ."""
+def embed_batch(texts, retries=EMBED_RETRIES, backoff=1.0, http=None):
+    """Embed a batch of texts with Ollama's /api/embed, retrying with exponential backoff.
+
+    `http` is the requests session to post with (default: the module's session).
+    """
+    http = http or session
+    for attempt in range(retries + 1):
+        try:
+            response = http.post(
+                f"{OLLAMA_API}/embed",
+                json={"model": EMBED_MODEL, "input": texts},
+                timeout=EMBED_TIMEOUT
+            )
+            response.raise_for_status()
+            embeddings = response.json()["embeddings"]
+            if len(embeddings) != len(texts):
+                raise ValueError(f"Expected {len(texts)} embeddings, got {len(embeddings)}")
+            return np.array(embeddings, dtype=np.float32)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = backoff * 2 ** attempt
+            logging.warning(f"Embedding batch of {len(texts)} failed ({str(e)}); retrying in {delay:.0f}s")
+            time.sleep(delay)
+
+def embed_texts(texts, batch_size=EMBED_BATCH_SIZE, concurrency=EMBED_CONCURRENCY):
+    """Embed texts in batches with at most `concurrency` requests in flight.
+
+    The requests share a session whose connection pool is sized for
+    `concurrency`, so no request waits for or discards a pooled connection.
+    Returns one embedding row per text, or None for texts whose batch still
+    failed after its retries. Progress and throughput are reported every
+    PROGRESS_INTERVAL seconds instead of once per chunk.
+    """
+    results = [None] * len(texts)
+    batches = [(start, texts[start:start + batch_size]) for start in range(0, len(texts), batch_size)]
+    done = failed = 0
+    started = last_report = time.monotonic()
+
+    with make_session(concurrency) as http, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(embed_batch, batch, http=http): (start, len(batch)) for start, batch in batches}
+        for future in as_completed(futures):
+            start, size = futures[future]
+            try:
+                embeddings = future.result()
+                results[start:start + size] = list(embeddings)
+            except Exception as e:
+                failed += size
+                logging.error(f"Failed to embed chunks {start}-{start + size - 1}: {str(e)}")
+            done += size
+            now = time.monotonic()
+            if now - last_report >= PROGRESS_INTERVAL or done == len(texts):
+                rate = done / max(now - started, 1e-9)
+                message = f"Embedded {done}/{len(texts)} chunks ({rate:.1f} chunks/s, {failed} failed)"
+                logging.info(message)
+                print(message)
+                last_report = now
+    return results
+
+def validate_chunk(name, content):
+    """Return the post URL on a chunk's second line, or None (with a warning) if it is unusable."""
+    if not content:
+        logging.warning(f"Empty chunk: {name}")
+        return None
+    lines = content.split("\n")
+    if len(lines) < 2:
+        logging.warning(f"Skipping chunk {name}: Missing or invalid Post URL")
+        return None
+    post_url = lines[1].replace("**Post URL**: ", "").strip()
+    if not post_url:
+        logging.warning(f"Skipping chunk {name}: Empty Post URL")
+        return None
+    return post_url
+
+def read_chunks():
+    """Read and validate every chunk, returning (texts, metadata).
+
+    Standalone .md files in the chunks directory (course pages and legacy
+    per-post chunks) come first in file order, followed by the sharded forum
+    chunks in index order. Shard metadata records the shard, offset and
+    length so the server can read a chunk back without a file per post.
+    """
+    if not os.path.exists(chunks_dir):
+        logging.error(f"Chunks directory {chunks_dir} not found")
+        raise FileNotFoundError(f"Chunks directory {chunks_dir} not found")
+    
+    chunk_files = sorted([f for f in os.listdir(chunks_dir) if f.endswith(".md")])
+    shard_dir = os.path.join(chunks_dir, shard_dirname)
+    if not chunk_files and not read_shard_index(shard_dir):
+        logging.error(f"No .md files or shards found in {chunks_dir}")
+        raise ValueError(f"No .md files or shards found in {chunks_dir}")
+    
     chunk_texts = []
     chunk_metadata = []
-    embeddings_list = []
-    
+    for chunk_file in chunk_files:
+        chunk_path = os.path.join(chunks_dir, chunk_file)
+        try:
+            with open(chunk_path, "r", encoding="utf-8") as f:
+                content = f.read().strip()
+            post_url = validate_chunk(chunk_file, content)
+            if post_url is None:
+                continue
+            
+            chunk_texts.append(content)
+            chunk_metadata.append({"file": chunk_file, "post_url": post_url, "preview": extract_content_preview(content)})
+        except Exception as e:
+            logging.error(f"Error reading {chunk_file}: {str(e)}")
+            continue
+    for entry, content in iter_shard_chunks(shard_dir):
+        content = content.strip()
+        post_url = validate_chunk(entry["id"], content)
+        if post_url is None:
+            continue
+        chunk_texts.append(content)
+        chunk_metadata.append({
+            "file": entry["id"],
+            "shard": entry["shard"],
+            "offset": entry["offset"],
+            "length": entry["length"],
+            "post_url": post_url,
+            "preview": extract_content_preview(content),
+        })
+    return chunk_texts, chunk_metadata
+
+def content_hash(text):
+    """Return the SHA-256 hex digest of a chunk's text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def load_previous_store():
+    """Return (header, embeddings, {sha256: row}) of the current store version.
+
+    Returns (None, None, {}) when there is no usable previous version: none
+    published yet, no manifest, or a different embedding model.
+    """
+    version = read_current(store_dir)
+    if version is None:
+        return None, None, {}
+    version_dir = os.path.join(store_dir, version)
+    try:
+        embeddings, _, header = open_version(version_dir)
+        manifest = read_manifest(version_dir)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring previous store version {version}: {str(e)}")
+        return None, None, {}
+    if manifest is None or manifest.get("model") != EMBED_MODEL:
+        logging.info(f"Previous store version {version} has no manifest for {EMBED_MODEL}; embedding everything")
+        return None, None, {}
+    rows = {entry["sha256"]: i for i, entry in enumerate(manifest["chunks"])}
+    return header, embeddings, rows
+
+def generate_embeddings(dtype="float32", quantize=None, ann_index=None, ann_params=None, batch_size=EMBED_BATCH_SIZE, concurrency=EMBED_CONCURRENCY, incremental=True, dedup="near", dedup_threshold=DEDUP_THRESHOLD):
+    """Generate embeddings for chunks and publish them as a new store version.
+
+    Duplicate chunks are first collapsed into one canonical chunk per group
+    (see dedup.deduplicate); `dedup` "exact" or "off" limits that, and the
+    report is stored in the header. With `incremental`, chunks whose content
+    hash is in the current version's manifest reuse their stored rows; only
+    new or changed chunks are embedded and deleted ones are dropped. Nothing
+    is published when the chunks and build options are unchanged. Chunks are
+    embedded in batches of `batch_size` with up to `concurrency` requests in
+    flight.
+
+    The chunk texts are packed into the version alongside the matrix, with
+    previews precomputed in the metadata, a BM25 index over them and the
+    created_at, topic_id, author and source columns used by filters. With
+    `ann_index` ("hnsw" or "ivf") the matching approximate index is built
+    with `ann_params` and stored in the same version for main.py to load.
+    """
     try:
-        if not os.path.exists(chunks_dir):
-            logging.error(f"Chunks directory {chunks_dir} not found")
-            raise FileNotFoundError(f"Chunks directory {chunks_dir} not found")
+        candidate_texts, candidate_metadata = read_chunks()
+        candidate_texts, candidate_metadata, dedup_report = deduplicate(candidate_texts, candidate_metadata, dedup, dedup_threshold)
+        logging.info(format_report(dedup_report))
+        print(format_report(dedup_report))
+        hashes = [content_hash(text) for text in candidate_texts]
+        previous_header, previous_embeddings, previous_rows = load_previous_store() if incremental else (None, None, {})
         
-        chunk_files = sorted([f for f in os.listdir(chunks_dir) if f.endswith(".md")])
-        if not chunk_files:
-            logging.error(f"No .md files found in {chunks_dir}")
-            raise ValueError(f"No .md files found in {chunks_dir}")
+        reused = [previous_rows.get(digest) for digest in hashes]
+        to_embed = [i for i, row in enumerate(reused) if row is None]
+        started = time.monotonic()
+        fresh = embed_texts([candidate_texts[i] for i in to_embed], batch_size=batch_size, concurrency=concurrency)
+        embedded = [None if row is None else previous_embeddings[row] for row in reused]
+        for i, embedding in zip(to_embed, fresh):
+            embedded[i] = embedding
         
-        for chunk_file in chunk_files:
-            chunk_path = os.path.join(chunks_dir, chunk_file)
-            try:
-                with open(chunk_path, "r", encoding="utf-8") as f:
-                    content = f.read().strip()
-                if not content:
-                    logging.warning(f"Empty chunk: {chunk_file}")
-                    continue
-                
-                lines = content.split("\n")
-                if len(lines) < 2:
-                    logging.warning(f"Skipping chunk {chunk_file}: Missing or invalid Post URL")
-                    logging.debug(f"Content of {chunk_file}:\n{content}")
-                    continue
-                post_url = lines[1].replace("**Post URL**: ", "").strip()
-                if not post_url:
-                    logging.warning(f"Skipping chunk {chunk_file}: Empty Post URL")
-                    continue
-                
-                embedding = embed_text(content)
-                if embedding is None:
-                    logging.error(f"Failed to embed {chunk_file}")
-                    continue
-                
-                chunk_texts.append(content)
-                chunk_metadata.append({"file": chunk_file, "post_url": post_url})
-                embeddings_list.append(embedding)
-                logging.info(f"Processed chunk {chunk_file} with Post URL: {post_url}")
-            except Exception as e:
-                logging.error(f"Error reading {chunk_file}: {str(e)}")
+        chunk_texts = []
+        chunk_metadata = []
+        manifest = []
+        embeddings_list = []
+        for content, entry, digest, embedding in zip(candidate_texts, candidate_metadata, hashes, embedded):
+            if embedding is None:
                 continue
+            chunk_texts.append(content)
+            chunk_metadata.append(entry)
+            manifest.append({"file": entry["file"], "sha256": digest})
+            embeddings_list.append(np.asarray(embedding, dtype=np.float32))
         
         if not embeddings_list:
             logging.error("No valid chunks found for embedding")
             raise ValueError("No valid chunks found for embedding")
+        dropped = len(set(previous_rows.values()) - {row for row in reused if row is not None})
+        summary = f"{len(to_embed)} embedded, {len(candidate_texts) - len(to_embed)} reused, {dropped} dropped in {time.monotonic() - started:.1f}s"
+        logging.info(f"Chunks: {summary}")
+        print(f"Chunks: {summary}")
         
-        # Create FAISS index
         embeddings = np.stack(embeddings_list)
-        dimension = embeddings.shape[1]
-        index = faiss.IndexFlatL2(dimension)
-        index.add(embeddings)
         
-        # Save to NPZ
-        np.savez_compressed(
-            npz_path,
-            embeddings=embeddings,
-            metadata=json.dumps(chunk_metadata)
+        unchanged = (
+            previous_header is not None
+            and not to_embed
+            and not dropped
+            and reused == list(range(len(reused)))
+            and previous_header.get("dtype") == dtype
+            and previous_header.get("quantized") == quantize
+            # The header records the ANN kind with its build parameters
+            and previous_header.get("ann_index") == ({"kind": ann_index, **(ann_params or {})} if ann_index else None)
+            and previous_header.get("columns")
+            and previous_header.get("dedup") == dedup_report
         )
-        logging.info(f"Saved embeddings and metadata to {npz_path} ({len(embeddings_list)} chunks)")
-        return index, chunk_texts, chunk_metadata
+        if unchanged:
+            logging.info("Vector store is up to date; not publishing a new version")
+            print("Vector store is up to date.")
+            return chunk_texts, chunk_metadata
+        
+        # Publish as a new version of the memory-mapped store, with its ANN index if requested
+        writers = [
+            content_pack_writer(chunk_texts),
+            manifest_writer(manifest, EMBED_MODEL),
+            bm25_writer(chunk_texts),
+            columns_writer(chunk_texts, chunk_metadata),
+            dedup_writer(dedup_report),
+        ]
+        if ann_index:
+            writers.append(ann_index_writer(ann_index, **(ann_params or {})))
+        version_dir = write_store(store_dir, embeddings, chunk_metadata, model=EMBED_MODEL, dtype=dtype, quantize=quantize, writers=writers)
+        logging.info(f"Saved embeddings and metadata to {version_dir} ({len(embeddings_list)} chunks)")
+        return chunk_texts, chunk_metadata
     except Exception as e:
         logging.error(f"Error generating embeddings: {str(e)}")
         raise
 
 def load_vector_store():
-    """Load FAISS index and metadata from NPZ."""
+    """Load the embeddings and metadata from the store directory, or the legacy NPZ."""
     try:
-        with np.load(npz_path, allow_pickle=True) as data:
-            embeddings = data["embeddings"]
-            chunk_metadata = json.loads(data["metadata"])
-        
-        dimension = embeddings.shape[1]
-        index = faiss.IndexFlatL2(dimension)
-        index.add(embeddings)
-        logging.info(f"Loaded FAISS index and metadata from {npz_path}")
-        return index, chunk_metadata
+        version = read_current(store_dir)
+        if version is not None:
+            embeddings, chunk_metadata, _ = open_version(os.path.join(store_dir, version))
+            source = os.path.join(store_dir, version)
+        else:
+            embeddings, chunk_metadata = read_npz(npz_path)
+            source = npz_path
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        logging.info(f"Loaded embeddings and metadata from {source}")
+        return embeddings, chunk_metadata
     except Exception as e:
-        logging.error(f"Error loading NPZ file: {str(e)}")
+        logging.error(f"Error loading vector store: {str(e)}")
         return None, None
 
-def retrieve_top_chunks(query, index, metadata, k=5):
-    """Retrieve top-k chunks for query."""
+def retrieve_top_chunks(query, embeddings, metadata, k=5):
+    """Retrieve the top-k chunks for query by squared L2 distance to its embedding."""
     try:
         query_embedding = embed_text(query)
         if query_embedding is None:
             logging.error(f"Failed to embed query: {query}")
             return []
         
-        distances, indices = index.search(np.array([query_embedding]), k)
+        distances = np.einsum("ij,ij->i", embeddings, embeddings) - 2 * np.dot(embeddings, query_embedding) + np.dot(query_embedding, query_embedding)
+        indices = select_top_k(-distances, k)
         results = []
-        for idx, distance in zip(indices[0], distances[0]):
+        for idx, distance in zip(indices, distances[indices]):
             if idx < 0 or idx >= len(metadata):
                 logging.warning(f"Invalid index {idx} for metadata length {len(metadata)}")
                 continue
             try:
-                with open(os.path.join(chunks_dir, metadata[idx]["file"]), "r", encoding="utf-8") as f:
-                    content = f.read()
+                content = read_chunk_text(chunks_dir, metadata[idx])
                 results.append({
                     "content": content,
                     "post_url": metadata[idx]["post_url"],
@@ -149,19 +351,41 @@ def retrieve_top_chunks(query, index, metadata, k=5):
         return []
 
 def main():
+    parser = argparse.ArgumentParser(description="Embed chunks into the vector store.")
+    parser.add_argument("--full", action="store_true", help="Re-embed every chunk instead of only new or changed ones")
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float32", help="On-disk matrix dtype")
+    parser.add_argument("--quantize", choices=["int8", "float16"], help="Also store a quantized copy for SCORING_MODE")
+    parser.add_argument("--index", choices=["hnsw", "ivf"], help="Also build an ANN index for RETRIEVAL_BACKEND")
+    parser.add_argument("--hnsw-m", type=int, default=32, help="HNSW graph degree")
+    parser.add_argument("--ef-construction", type=int, default=200, help="HNSW build-time search depth")
+    parser.add_argument("--nlist", type=int, help="IVF cluster count (default ~4*sqrt(n))")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE, help="Chunks per embedding request")
+    parser.add_argument("--concurrency", type=int, default=EMBED_CONCURRENCY, help="Embedding requests in flight")
+    parser.add_argument("--dedup", choices=DEDUP_MODES, default="near", help="Collapse near and exact, only exact, or no duplicate chunks")
+    parser.add_argument("--dedup-threshold", type=float, default=DEDUP_THRESHOLD, help="Estimated Jaccard similarity of near duplicates")
+    args = parser.parse_args()
+    if args.index == "hnsw":
+        ann_params = {"hnsw_m": args.hnsw_m, "ef_construction": args.ef_construction}
+    elif args.index == "ivf":
+        ann_params = {"nlist": args.nlist}
+    else:
+        ann_params = None
+    build = dict(
+        dtype=args.dtype,
+        quantize=args.quantize,
+        ann_index=args.index,
+        ann_params=ann_params,
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        dedup=args.dedup,
+        dedup_threshold=args.dedup_threshold,
+    )
     try:
-        if os.path.exists(npz_path):
-            print("Loading vector store from NPZ...")
-            index, chunk_metadata = load_vector_store()
-            if index is None:
-                print("Failed to load NPZ file. Generating new embeddings...")
-                index, chunk_texts, chunk_metadata = generate_embeddings()
-        else:
-            print("Generating embeddings...")
-            index, chunk_texts, chunk_metadata = generate_embeddings()
+        print("Updating vector store..." if not args.full else "Generating embeddings...")
+        generate_embeddings(incremental=not args.full, **build)
     except Exception as e:
         logging.error(f"Script failed: {str(e)}")
         print(f"Script failed: {str(e)}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()